@@ -1,6 +1,24 @@
-from alloprompt import prompt, utils
+from alloprompt import prompt, utils, cache, instrumentation, registry, examples, policy, batching
 
 Prompt = prompt.Prompt
 set_code_gen_client = utils.set_code_gen_client
 set_code_gen_model = utils.set_code_gen_model
 set_client_llm = utils.set_client_llm
+set_template_cache_size = utils.set_template_cache_size
+set_async_parse_client = utils.set_async_parse_client
+set_max_concurrency = utils.set_max_concurrency
+set_cache_dir = utils.set_cache_dir
+ResponseCache = cache.ResponseCache
+add_hook = instrumentation.add_hook
+remove_hook = instrumentation.remove_hook
+HistogramCollector = instrumentation.HistogramCollector
+set_bytecode_cache_dir = utils.set_bytecode_cache_dir
+PromptRegistry = registry.PromptRegistry
+set_code_gen_candidates = utils.set_code_gen_candidates
+set_code_test_timeout = utils.set_code_test_timeout
+ExampleIndex = examples.ExampleIndex
+count_tokens = examples.count_tokens
+RequestPolicy = policy.RequestPolicy
+set_request_policy = utils.set_request_policy
+ParseBatcher = batching.ParseBatcher
+set_parse_batcher = utils.set_parse_batcher
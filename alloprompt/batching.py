@@ -0,0 +1,239 @@
+import copy
+import json
+import asyncio
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from alloprompt import utils
+from alloprompt.instrumentation import event
+
+
+class _LoopBatch:
+    # Pending async parse calls of one event loop, only used from that loop's thread.
+    def __init__(self):
+        self.pending = OrderedDict()
+        self.handle = None
+        self.tasks = set()
+
+
+class ParseBatcher:
+    """
+    Coalesces concurrent LLM parse calls into a single JSON mode request.
+
+    Parse calls wait up to `window` seconds for other calls (or until `max_batch` are pending), then all the
+    pending (response, output template) pairs are sent in one request sharing the few-shot prompt, and every
+    caller receives its own values. Every entry of the batched answer must give the number of its item; items
+    missing from the answer, unnumbered or answered twice are parsed again on their own. Results are memoized
+    by a hash of the output template and of the response, and identical pending calls share the same request.
+
+    Args:
+        window (float): The number of seconds a parse call waits for others.
+        max_batch (int): The number of items sent in one request.
+        memo_size (int): The number of parsed responses kept in memory.
+
+    Example:
+        set_parse_batcher(ParseBatcher(window=0.05, max_batch=20))
+    """
+
+    def __init__(self, window=0.02, max_batch=16, memo_size=4096):
+        self.window = window
+        self.max_batch = max_batch
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.timer = None
+        self.loop_batches = weakref.WeakKeyDictionary()
+        self.requests = 0
+        self.items = 0
+        self.memo_hits = 0
+
+    @staticmethod
+    def key(rendered_template, template):
+        payload = json.dumps([template, rendered_template])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _recall(self, key):
+        # Must be called with the lock held.
+        values = self.memo.get(key, self)
+        if values is self:
+            return self
+        self.memo.move_to_end(key)
+        self.memo_hits += 1
+        event("parse_memo", hit=True)
+        return copy.deepcopy(values)
+
+    def _remember(self, key, values):
+        with self.lock:
+            self.memo[key] = values
+            self.memo.move_to_end(key)
+            while len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+
+    @staticmethod
+    def _split(response, size):
+        # Returns the values of every item of a batched answer, matched by the item number of each entry.
+        # Items that are missing, malformed, unnumbered or answered more than once get None.
+        values = [None] * size
+        items = response.get("items") if isinstance(response, dict) else None
+        if not isinstance(items, list):
+            return values
+        answered = set()
+        for item in items:
+            number = item.get("item") if isinstance(item, dict) else None
+            if type(number) is not int or not 1 <= number <= size or "values" not in item:
+                continue
+            values[number - 1] = item["values"] if number not in answered else None
+            answered.add(number)
+        return values
+
+    def _take(self):
+        batch = list(self.pending.items())
+        self.pending = OrderedDict()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return batch
+
+    def parse(self, rendered_template, template):
+        key = self.key(rendered_template, template)
+        batch = None
+        with self.lock:
+            values = self._recall(key)
+            if values is not self:
+                return values
+            entry = self.pending.get(key)
+            if entry is None:
+                entry = (rendered_template, template, Future())
+                self.pending[key] = entry
+                if len(self.pending) >= self.max_batch:
+                    batch = self._take()
+                elif self.timer is None:
+                    self.timer = threading.Timer(self.window, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+        if batch is not None:
+            self._send(batch)
+        return copy.deepcopy(entry[2].result())
+
+    def flush(self):
+        """Sends the pending parse calls without waiting for the window to end."""
+        with self.lock:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def _count(self, requests, items=0):
+        with self.lock:
+            self.requests += requests
+            self.items += items
+
+    def _send(self, batch):
+        try:
+            self._count(1, len(batch))
+            if len(batch) == 1:
+                _, (rendered_template, template, _) = batch[0]
+                results = [utils.llm_parse_request(utils.llm_parse_messages(rendered_template, template))["values"]]
+            else:
+                messages = utils.llm_parse_batch_messages([entry[:2] for _, entry in batch])
+                try:
+                    results = self._split(utils.llm_parse_request(messages, items=len(batch)), len(batch))
+                except json.JSONDecodeError:
+                    results = [None] * len(batch)
+        except Exception as error:
+            for _, (_, _, future) in batch:
+                future.set_exception(error)
+            return
+        for (key, (rendered_template, template, future)), values in zip(batch, results):
+            if values is None:
+                event("parse_fallback", reason="batch_item")
+                try:
+                    self._count(1)
+                    values = utils.llm_parse_request(utils.llm_parse_messages(rendered_template, template))["values"]
+                except Exception as error:
+                    future.set_exception(error)
+                    continue
+            self._remember(key, values)
+            future.set_result(values)
+
+    def _loop_batch(self, loop):
+        with self.lock:
+            loop_batch = self.loop_batches.get(loop)
+            if loop_batch is None:
+                loop_batch = self.loop_batches[loop] = _LoopBatch()
+            return loop_batch
+
+    @staticmethod
+    def _atake(loop_batch):
+        batch = list(loop_batch.pending.items())
+        loop_batch.pending = OrderedDict()
+        if loop_batch.handle is not None:
+            loop_batch.handle.cancel()
+            loop_batch.handle = None
+        return batch
+
+    def _astart(self, loop_batch):
+        task = asyncio.ensure_future(self._asend(self._atake(loop_batch)))
+        loop_batch.tasks.add(task)
+        task.add_done_callback(loop_batch.tasks.discard)
+
+    async def aparse(self, rendered_template, template):
+        """
+        Async version of `parse`. Calls are batched per event loop: coroutines running on different loops
+        never share a request.
+        """
+        key = self.key(rendered_template, template)
+        with self.lock:
+            values = self._recall(key)
+        if values is not self:
+            return values
+        loop = asyncio.get_running_loop()
+        loop_batch = self._loop_batch(loop)
+        entry = loop_batch.pending.get(key)
+        if entry is None:
+            entry = (rendered_template, template, loop.create_future())
+            loop_batch.pending[key] = entry
+            if len(loop_batch.pending) >= self.max_batch:
+                self._astart(loop_batch)
+            elif loop_batch.handle is None:
+                loop_batch.handle = loop.call_later(self.window, self._astart, loop_batch)
+        # Shielded: a cancelled caller must not cancel the result shared with the other callers.
+        return copy.deepcopy(await asyncio.shield(entry[2]))
+
+    async def _asend(self, batch):
+        try:
+            self._count(1, len(batch))
+            if len(batch) == 1:
+                _, (rendered_template, template, _) = batch[0]
+                response = await utils.allm_parse_request(utils.llm_parse_messages(rendered_template, template))
+                results = [response["values"]]
+            else:
+                messages = utils.llm_parse_batch_messages([entry[:2] for _, entry in batch])
+                try:
+                    results = self._split(await utils.allm_parse_request(messages, items=len(batch)), len(batch))
+                except json.JSONDecodeError:
+                    results = [None] * len(batch)
+        except Exception as error:
+            for _, (_, _, future) in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (key, (rendered_template, template, future)), values in zip(batch, results):
+            if values is None:
+                event("parse_fallback", reason="batch_item")
+                try:
+                    self._count(1)
+                    response = await utils.allm_parse_request(utils.llm_parse_messages(rendered_template, template))
+                    values = response["values"]
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+                    continue
+            self._remember(key, values)
+            if not future.done():
+                future.set_result(values)
+
+    def stats(self):
+        return {"requests": self.requests, "items": self.items, "memo_hits": self.memo_hits}
@@ -0,0 +1,124 @@
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from alloprompt.instrumentation import event
+
+
+class ResponseCache:
+    """
+    Cache of completion responses with an in-memory LRU tier in front of an optional SQLite store.
+
+    Args:
+        path (str): The SQLite database file, or None to only keep responses in memory.
+        max_entries (int): The number of responses kept in memory.
+        ttl (float): The number of seconds a response stays valid, or None to keep it forever.
+        force (bool): Also cache sampled requests (temperature > 0), which are bypassed by default.
+    """
+
+    def __init__(self, path=None, max_entries=1024, ttl=None, force=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.force = force
+        self.hits = 0
+        self.misses = 0
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            self.connection.commit()
+
+    def key(self, prompt, chat_complete_args):
+        """
+        Returns the canonical hash of a request, or None when the request must not be cached.
+
+        Args:
+            prompt (str, list): The rendered text prompt or list of messages.
+            chat_complete_args (dict): The arguments sent with the prompt (model, sampling, ...).
+        """
+        if chat_complete_args.get("stream", False):
+            return None
+        # The API samples with temperature 1 when none is given.
+        temperature = chat_complete_args.get("temperature")
+        if not self.force and (1 if temperature is None else temperature) > 0:
+            return None
+        payload = json.dumps({"prompt": prompt, "args": chat_complete_args}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[1] is None or entry[1] > now:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    event("response_cache", hit=True, tier="memory")
+                    return entry[0]
+                del self.memory[key]
+            if self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and (row[1] is None or row[1] > now):
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    event("response_cache", hit=True, tier="disk")
+                    return row[0]
+                if row is not None:
+                    self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.connection.commit()
+            self.misses += 1
+            event("response_cache", hit=False)
+            return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self._remember(key, value, expires_at)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                # Expired responses that are never read again would otherwise stay on disk forever.
+                self.connection.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+                self.connection.commit()
+
+    async def aget(self, key):
+        """Async version of `get`: the SQLite query runs in a worker thread instead of the event loop."""
+        if self.connection is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key, value):
+        """Async version of `set`: the SQLite writes run in a worker thread instead of the event loop."""
+        if self.connection is None:
+            return self.set(key, value)
+        return await asyncio.to_thread(self.set, key, value)
+
+    def _remember(self, key, value, expires_at):
+        self.memory[key] = (value, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.connection is not None:
+                self.connection.execute("DELETE FROM responses")
+                self.connection.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.memory)}
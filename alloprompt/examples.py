@@ -0,0 +1,98 @@
+import re
+import math
+from collections import Counter
+
+_token_pattern = re.compile(r"\w+|[^\w\s]")
+_term_pattern = re.compile(r"\w+")
+
+
+def count_tokens(text):
+    """
+    Offline approximation of the number of tokens of a text: one token per word and per punctuation sign.
+
+    Any callable taking a text and returning its number of tokens can be used instead, for example
+    `lambda text: len(encoding.encode(text))` with a tiktoken encoding.
+    """
+    return len(_token_pattern.findall(text))
+
+
+def example_text(example):
+    """Concatenates all the strings contained in an example, whatever its structure."""
+    if isinstance(example, str):
+        return example
+    if isinstance(example, dict):
+        return "\n".join(example_text(value) for value in example.values())
+    if isinstance(example, (list, tuple)):
+        return "\n".join(example_text(value) for value in example)
+    return "" if example is None else str(example)
+
+
+def terms(text):
+    return _term_pattern.findall(text.lower())
+
+
+class ExampleIndex:
+    """
+    Precomputed token lengths and lexical (BM25) index of a list of few-shot examples.
+
+    Args:
+        examples (list): The examples, as found in the prompt data.
+        token_counter (callable): Returns the number of tokens of a text, defaults to `count_tokens`.
+    """
+
+    k1 = 1.5
+    b = 0.75
+
+    def __init__(self, examples, token_counter=None):
+        token_counter = token_counter or count_tokens
+        self.examples = examples
+        texts = [example_text(example) for example in examples]
+        self.lengths = [token_counter(text) for text in texts]
+        self.term_frequencies = [Counter(terms(text)) for text in texts]
+        self.document_lengths = [sum(frequencies.values()) for frequencies in self.term_frequencies]
+        self.average_length = sum(self.document_lengths) / len(examples) if examples else 0
+        document_frequencies = Counter(term for frequencies in self.term_frequencies for term in frequencies)
+        self.idf = {
+            term: math.log(1 + (len(examples) - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequencies.items()
+        }
+
+    def scores(self, query):
+        query_terms = set(terms(query))
+        scores = []
+        for frequencies, length in zip(self.term_frequencies, self.document_lengths):
+            score = 0.0
+            normalization = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+            for term in query_terms:
+                frequency = frequencies.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + normalization)
+            scores.append(score)
+        return scores
+
+    def select(self, budget=None, query=None, max_examples=None):
+        """
+        Selects the examples fitting in a token budget.
+
+        Args:
+            budget (int): The maximum number of tokens of the selected examples, None for no limit.
+            query (str): When given, the examples most relevant to it are picked first.
+            max_examples (int): The maximum number of examples.
+
+        Returns:
+            list: The selected examples, in their original order.
+        """
+        order = range(len(self.examples))
+        if query:
+            scores = self.scores(query)
+            order = sorted(order, key=lambda i: -scores[i])
+        selected = []
+        used = 0
+        for i in order:
+            if max_examples is not None and len(selected) >= max_examples:
+                break
+            if budget is not None and used + self.lengths[i] > budget:
+                continue
+            selected.append(i)
+            used += self.lengths[i]
+        return [self.examples[i] for i in sorted(selected)]
@@ -0,0 +1,172 @@
+import math
+import time
+import threading
+
+_hooks = []
+
+
+def add_hook(hook):
+    """
+    Registers a callable receiving one event dict per instrumented stage.
+
+    Events have a `stage` name, a `duration` in seconds (0 for point events), an `error` (the exception
+    class name or None) and stage specific attributes such as sizes, token usage or cache hits.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def emit(event):
+    for hook in list(_hooks):
+        hook(event)
+
+
+class _Span:
+    __slots__ = ("stage", "attributes", "start")
+
+    def __init__(self, stage, attributes):
+        self.stage = stage
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.attributes
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.start
+        emit(
+            {
+                "stage": self.stage,
+                "duration": duration,
+                "error": exc_type.__name__ if exc_type else None,
+                **self.attributes,
+            }
+        )
+        return False
+
+
+class _NullAttributes(dict):
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+class _NullSpan:
+    attributes = _NullAttributes()
+
+    def __enter__(self):
+        return self.attributes
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+def span(stage, **attributes):
+    """
+    Times a stage. Attributes known only at the end can be added to the dict returned by `with`:
+
+        with span("request", model=model) as attributes:
+            attributes["response_chars"] = len(response)
+
+    Without hooks, a shared no-op span is returned and nothing is timed.
+    """
+    if not _hooks:
+        return _null_span
+    return _Span(stage, attributes)
+
+
+def event(stage, **attributes):
+    """Reports a point event such as a cache hit or a parse fallback."""
+    if _hooks:
+        emit({"stage": stage, "duration": 0.0, "error": None, **attributes})
+
+
+class HistogramCollector:
+    """
+    In-memory hook aggregating events per stage.
+
+    Durations go into logarithmic buckets (4 per power of 10, from 1 microsecond) from which
+    percentiles are estimated, and numeric attributes (sizes, token counts) are summed. Boolean
+    attributes such as `hit` are counted as `<name>_true`.
+    """
+
+    buckets_per_decade = 4
+    min_duration = 1e-6
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def _bucket(self, duration):
+        if duration <= self.min_duration:
+            return 0
+        return int(math.log10(duration / self.min_duration) * self.buckets_per_decade) + 1
+
+    def _bucket_upper_bound(self, bucket):
+        return self.min_duration * 10 ** (bucket / self.buckets_per_decade)
+
+    def __call__(self, event):
+        with self.lock:
+            stage = self.stages.setdefault(
+                event["stage"], {"count": 0, "errors": 0, "total": 0.0, "max": 0.0, "buckets": {}, "sums": {}}
+            )
+            duration = event["duration"]
+            stage["count"] += 1
+            stage["errors"] += event.get("error") is not None
+            stage["total"] += duration
+            stage["max"] = max(stage["max"], duration)
+            bucket = self._bucket(duration)
+            stage["buckets"][bucket] = stage["buckets"].get(bucket, 0) + 1
+            for key, value in event.items():
+                if key in ("stage", "duration", "error"):
+                    continue
+                if isinstance(value, bool):
+                    key, value = f"{key}_true", int(value)
+                elif not isinstance(value, (int, float)):
+                    continue
+                stage["sums"][key] = stage["sums"].get(key, 0) + value
+
+    def percentile(self, stage, percentile):
+        with self.lock:
+            buckets = self.stages[stage]["buckets"]
+            count = self.stages[stage]["count"]
+            seen = 0
+            for bucket in sorted(buckets):
+                seen += buckets[bucket]
+                if seen >= percentile / 100 * count:
+                    return min(self._bucket_upper_bound(bucket), self.stages[stage]["max"])
+        return self.stages[stage]["max"]
+
+    def summary(self):
+        """
+        Returns:
+            dict: For every stage, the count, errors, total, mean, p50, p95, p99 and max durations in
+            seconds and the sums of numeric attributes.
+        """
+        summary = {}
+        for name in list(self.stages):
+            stage = self.stages[name]
+            summary[name] = {
+                "count": stage["count"],
+                "errors": stage["errors"],
+                "total": stage["total"],
+                "mean": stage["total"] / stage["count"],
+                "p50": self.percentile(name, 50),
+                "p95": self.percentile(name, 95),
+                "p99": self.percentile(name, 99),
+                "max": stage["max"],
+                **stage["sums"],
+            }
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
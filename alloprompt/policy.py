@@ -0,0 +1,207 @@
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from alloprompt.instrumentation import event
+
+
+class RequestTimeout(TimeoutError):
+    pass
+
+
+def is_retryable(error):
+    """
+    Returns True for errors worth retrying: request timeouts, connection errors, rate limits (429),
+    conflicts (409) and server errors (5xx). The HTTP status is read from `status_code` as set by the
+    OpenAI client errors, so any client raising similar errors is supported.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+class RequestPolicy:
+    """
+    Timeout, retry and hedging rules applied to every request sent to the language model.
+
+    Args:
+        timeout (float): The number of seconds an attempt may take, hedge included, or None for no limit.
+        max_retries (int): The number of times a request is sent again after a retryable error.
+        backoff (float): The base delay before a retry, doubled at every retry and fully jittered.
+        max_backoff (float): The maximum delay before a retry.
+        hedge_after (float): Sends a duplicate request when the first one has not answered after this many
+            seconds, and keeps whichever answers first.
+        hedge_percentile (float): Instead of a fixed delay, hedges requests slower than this percentile of
+            the latencies observed so far (once `min_samples` latencies are known), e.g. 95.
+        min_samples (int): The number of latencies needed before hedging on a percentile.
+        retryable (callable): Returns True when an error must be retried, defaults to `is_retryable`.
+
+    Example:
+        policy = RequestPolicy(timeout=60, max_retries=3, hedge_percentile=95)
+        Prompt("template.xml.j2", request_policy=policy)
+    """
+
+    def __init__(
+        self,
+        timeout=None,
+        max_retries=2,
+        backoff=0.5,
+        max_backoff=30,
+        hedge_after=None,
+        hedge_percentile=None,
+        min_samples=20,
+        retryable=None,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.retryable = retryable or is_retryable
+        self.latencies = deque(maxlen=512)
+        self.lock = threading.Lock()
+
+    def hedge_delay(self):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if self.hedge_percentile is None:
+            return None
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))]
+
+    def backoff_delay(self, retry):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**retry))
+
+    def record_latency(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    @staticmethod
+    def start(function):
+        # Each request gets its own daemon thread, started right away: a pool would queue requests behind
+        # the ones still running (the queueing time counting against the timeout) and stay filled with
+        # abandoned requests.
+        future = Future()
+
+        def run():
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(function())
+            except BaseException as error:
+                future.set_exception(error)
+
+        threading.Thread(target=run, name="alloprompt-request", daemon=True).start()
+        return future
+
+    def call(self, function, hedge=True):
+        """
+        Calls `function` (a blocking request) following the policy and returns its result.
+
+        Without timeout or hedge, `function` runs on the calling thread. Otherwise each request runs in its
+        own thread, the hedge only being started when it is sent: Python threads cannot be interrupted, so
+        the losing or timed out request is abandoned rather than cancelled. Pass `hedge=False` for requests
+        whose result holds a connection open, such as streams.
+        """
+        retry = 0
+        while True:
+            try:
+                return self._attempt(function, hedge)
+            except Exception as error:
+                if retry >= self.max_retries or not self.retryable(error):
+                    raise
+                delay = self.backoff_delay(retry)
+                event("request_retry", retry=retry + 1, delay=delay, reason=type(error).__name__)
+                retry += 1
+                time.sleep(delay)
+
+    def _attempt(self, function, hedge):
+        hedge_delay = self.hedge_delay() if hedge else None
+        start = time.perf_counter()
+        if self.timeout is None and hedge_delay is None:
+            result = function()
+            self.record_latency(time.perf_counter() - start)
+            return result
+
+        futures = {self.start(function)}
+        deadline = start + self.timeout if self.timeout is not None else None
+        if hedge_delay is not None and (deadline is None or start + hedge_delay < deadline):
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done:
+                event("request_hedge", delay=hedge_delay)
+                futures.add(self.start(function))
+        error = None
+        while futures:
+            remaining = deadline - time.perf_counter() if deadline is not None else None
+            done, futures = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    self.record_latency(time.perf_counter() - start)
+                    return future.result()
+                error = future.exception()
+        if error is not None and not futures:
+            raise error
+        raise RequestTimeout(f"No response after {self.timeout} seconds")
+
+    async def acall(self, function, hedge=True):
+        """Async version of `call`: `function` returns a coroutine and the losing request is cancelled."""
+        retry = 0
+        while True:
+            try:
+                return await self._aattempt(function, hedge)
+            except Exception as error:
+                if retry >= self.max_retries or not self.retryable(error):
+                    raise
+                delay = self.backoff_delay(retry)
+                event("request_retry", retry=retry + 1, delay=delay, reason=type(error).__name__)
+                retry += 1
+                await asyncio.sleep(delay)
+
+    async def _aattempt(self, function, hedge):
+        hedge_delay = self.hedge_delay() if hedge else None
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if self.timeout is None and hedge_delay is None:
+            result = await function()
+            self.record_latency(loop.time() - start)
+            return result
+
+        tasks = {asyncio.ensure_future(function())}
+        deadline = start + self.timeout if self.timeout is not None else None
+        try:
+            if hedge_delay is not None and (deadline is None or start + hedge_delay < deadline):
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    event("request_hedge", delay=hedge_delay)
+                    tasks.add(asyncio.ensure_future(function()))
+            error = None
+            while tasks:
+                remaining = deadline - loop.time() if deadline is not None else None
+                done, tasks = await asyncio.wait(tasks, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        self.record_latency(loop.time() - start)
+                        return task.result()
+                    error = task.exception()
+            if error is not None and not tasks:
+                raise error
+            raise RequestTimeout(f"No response after {self.timeout} seconds")
+        finally:
+            for task in tasks:
+                task.cancel()
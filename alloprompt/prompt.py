@@ -1,16 +1,40 @@
+import os
 import re
-import yaml
 import json
+import asyncio
+import hashlib
+import weakref
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from alloprompt.utils import (
     reverse_template_auto,
     reverse_template_llm_parse,
-    recursive_escape_xml,
+    reverse_template_compiled,
+    areverse_template_llm_parse,
+    areverse_template_compiled,
+    get_semaphore,
+    RateLimiter,
+    record_usage,
+    send_request,
+    asend_request,
     convert_dict_to_yaml,
+    load_yaml_file,
     render_jinja2,
+    render_jinja2_xml,
+    render_template,
+    split_template,
     parse_xml,
     otag,
     ctag,
+    open_tag,
+    close_tag,
+    compile_message_skeleton,
 )
+from alloprompt.reverse_parser import compile_reverse_parser
+from alloprompt.instrumentation import span
+from alloprompt.examples import ExampleIndex
 
 
 def unindent(text):
@@ -32,7 +56,55 @@ def get_tag_content(tag, xml):
     return unindent(pattern.findall(xml)[0]).strip()
 
 
+_sections_pattern = re.compile(r"<(prompt|output_template|components)>(.*?)</\1>", re.DOTALL)
+
+
+def get_sections(template):
+    """
+    Splits a `.xml.j2` template into its `prompt`, `output_template` and `components` in a single pass.
+    """
+    contents = {}
+    for match in _sections_pattern.finditer(template):
+        contents.setdefault(match.group(1), unindent(match.group(2)).strip())
+    return {
+        "prompt": contents.get("prompt"),
+        "output_template": contents.get("output_template"),
+        "components": parse_xml(contents["components"]) if contents.get("components") else {},
+    }
+
+
+_template_files = {}
+_template_files_lock = threading.Lock()
+
+
+def load_template(path):
+    """
+    Reads and splits a template file, reusing the previous result while the file is unchanged.
+
+    The file is only read again when its mtime or size changed, and only split again when its content hash
+    changed, so every `Prompt` built from the same file shares the same sections.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _template_files.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[2]
+    with open(path, "r") as file:
+        template = file.read()
+    digest = hashlib.sha256(template.encode("utf-8")).hexdigest()
+    if cached is None or cached[1] != digest:
+        sections = get_sections(template)
+    else:
+        sections = cached[2]
+    with _template_files_lock:
+        _template_files[path] = (signature, digest, sections)
+    return sections
+
+
 class Prompt:
+    example_index_cache_size = 16
+
     def __init__(
         self,
         path,
@@ -43,36 +115,65 @@ class Prompt:
         stream_output_parsing_function=lambda x: x,
         default_chat_complete_args={},
         default_client=None,
+        default_async_client=None,
+        max_concurrency=None,
+        response_cache=None,
+        structured_render=None,
+        freeze=False,
+        example_budget=None,
+        token_counter=None,
+        request_policy=None,
     ):
-        with open(path, "r") as file:
-            template = file.read()
-        self.template = {
-            "prompt": get_tag_content("prompt", template),
-            "output_template": get_tag_content("output_template", template),
-            "components": (
-                parse_xml(get_tag_content("components", template)) if get_tag_content("components", template) else {}
-            ),
-        }
+        with span("load_template", path=path):
+            self.template = dict(load_template(path))
+        # Unless disabled, templates made only of messages are rendered straight into a list of messages.
+        self.structured_prompt = (
+            compile_message_skeleton(self.template["prompt"]) if structured_render is not False else None
+        )
+        if structured_render and self.structured_prompt is None:
+            raise ValueError("The prompt template cannot be rendered without going through XML")
         if output_parsing_function is None:
             self.reverse_template = lambda response, _, __: response
         if output_parsing_function == "auto":
             self.reverse_template = reverse_template_auto
         if output_parsing_function == "llm_parse":
             self.reverse_template = reverse_template_llm_parse
+        if output_parsing_function == "compiled":
+            self.reverse_template = reverse_template_compiled
         if type(output_parsing_function) is type(lambda: None):
             self.reverse_template = output_parsing_function
         self.data = data
         if data_path is not None:
-            with open(data_path, "r") as file:
-                self.data = {**self.data, **yaml.safe_load(file)}
+            with span("load_data", path=data_path):
+                self.data = {**self.data, **load_yaml_file(data_path)}
         self.functions = functions
+        self.example_budget = example_budget
+        self.token_counter = token_counter
+        self._example_indexes = OrderedDict()
+        self._example_indexes_lock = threading.Lock()
+        self._data_examples_index = None
+        if isinstance(self.data.get("examples"), list):
+            self._data_examples_index = ExampleIndex(self.data["examples"], self.token_counter)
         self.cache = {}
         self.default_chat_complete_args = default_chat_complete_args
         self.default_client = default_client
+        self.default_async_client = default_async_client
+        self.max_concurrency = max_concurrency
+        self._semaphores = weakref.WeakKeyDictionary()
+        self.response_cache = response_cache
+        self.request_policy = request_policy
         self.stream_output_parsing_function = stream_output_parsing_function
+        self.frozen = None
+        if freeze:
+            self.freeze()
+        if (
+            stream_output_parsing_function == "compiled"
+            and compile_reverse_parser(self.template["output_template"]) is None
+        ):
+            raise ValueError("The output template cannot be compiled into a streaming parser")
 
     def render(self, template, **data):
-        return render_jinja2(
+        return render_jinja2_xml(
             template,
             **data,
             render=lambda t, d: self.render(t, functions=self.functions, **d),
@@ -81,24 +182,157 @@ class Prompt:
             to_yaml=convert_dict_to_yaml,
         )
 
-    def render_prompt(self, inputs={}, inputs_yaml=None, debug=False):
-        if inputs_yaml:
-            with open(inputs_yaml, "r") as file:
-                inputs = {**yaml.safe_load(file), **inputs}
-        inputs = recursive_escape_xml(json.loads(json.dumps(inputs)))
-        rendered_prompt = self.render(
-            self.template["prompt"],
-            input=inputs,
-            data=recursive_escape_xml(json.loads(json.dumps(self.data))),
-            output_template=self.template["output_template"],
-            components=self.template["components"],
-            functions=self.functions,
+    def render_structured(self, template, **data):
+        return render_jinja2(
+            template,
+            **data,
+            render=lambda t, d: self.render_structured(t, functions=self.functions, **d),
+            otag=open_tag,
+            ctag=close_tag,
+            to_yaml=convert_dict_to_yaml,
         )
+
+    def render_context(self, structured):
+        render = self.render_structured if structured else self.render
+        return {
+            "render": lambda t, d: render(t, functions=self.functions, **d),
+            "otag": open_tag if structured else otag,
+            "ctag": close_tag if structured else ctag,
+            "to_yaml": convert_dict_to_yaml,
+            "data": self.data,
+            "output_template": self.template["output_template"],
+            "components": self.template["components"],
+            "functions": self.functions,
+            "select_examples": self.select_examples,
+        }
+
+    def example_index(self, examples):
+        # The index of `data.examples` is kept as long as the prompt, the indexes of other lists (e.g. taken
+        # from the inputs) in a small LRU.
+        if self._data_examples_index is not None and self._data_examples_index.examples is examples:
+            return self._data_examples_index
+        with self._example_indexes_lock:
+            entry = self._example_indexes.get(id(examples))
+            if entry is not None and entry[0] is examples:
+                self._example_indexes.move_to_end(id(examples))
+                return entry[1]
+        index = ExampleIndex(examples, self.token_counter)
+        with self._example_indexes_lock:
+            self._example_indexes[id(examples)] = (examples, index)
+            self._example_indexes.move_to_end(id(examples))
+            while len(self._example_indexes) > self.example_index_cache_size:
+                self._example_indexes.popitem(last=False)
+        return index
+
+    def select_examples(self, examples, budget=None, query=None, max_examples=None):
+        """
+        Template function selecting the few-shot examples that fit in a token budget.
+
+        Args:
+            examples (list): The examples, e.g. `data.examples`.
+            budget (int): The maximum number of tokens of the examples, defaults to `example_budget`.
+            query (str): When given, e.g. `input.content`, the examples sharing the most terms with it are
+                picked first.
+            max_examples (int): The maximum number of examples.
+
+        Returns:
+            list: The selected examples, in their original order.
+        """
+        budget = self.example_budget if budget is None else budget
+        if budget is None and max_examples is None:
+            return examples
+        return self.example_index(examples).select(budget, query, max_examples)
+
+    @staticmethod
+    def message_collector(events):
+        def message(role, caller):
+            events.append(("messages", {"role": role, "content": caller().strip()}))
+            return ""
+
+        def text_prompt(caller):
+            events.append(("text_prompt", caller().strip()))
+            return ""
+
+        return {"_message": message, "_text_prompt": text_prompt}
+
+    def freeze(self):
+        """
+        Pre-renders the top-level parts of the prompt template that do not depend on `input`.
+
+        `data`, `components`, `output_template` and `functions` are treated as constant from now on:
+        the static parts (e.g. the loop over few-shot examples) are rendered once, and each call only
+        renders the parts using `input`. Templates defining variables, macros or blocks outside of a
+        loop, macro or call block are left as they are.
+        """
+        structured = self.structured_prompt is not None
+        segments = split_template(
+            self.structured_prompt if structured else self.template["prompt"], escape=not structured
+        )
+        if segments is None:
+            return self
+        context = self.render_context(structured)
+        self.frozen = []
+        for is_dynamic, segment in segments:
+            if is_dynamic:
+                self.frozen.append((True, segment))
+            elif structured:
+                events = []
+                render_template(segment, **context, **self.message_collector(events))
+                self.frozen.append((False, events))
+            else:
+                self.frozen.append((False, render_template(segment, **context)))
+        return self
+
+    def render_messages(self, inputs):
+        events = []
+        context = {**self.render_context(True), **self.message_collector(events), "input": inputs}
+        if self.frozen is None:
+            render_jinja2(self.structured_prompt, **context)
+        else:
+            for is_dynamic, segment in self.frozen:
+                if is_dynamic:
+                    render_template(segment, **context)
+                else:
+                    events.extend(segment)
+        rendered_prompt = {}
+        # Copies keep the pre-rendered messages of a frozen prompt safe from callers mutating the result.
+        messages = [dict(value) for kind, value in events if kind == "messages"]
+        if messages:
+            rendered_prompt["messages"] = messages
+        for kind, value in events:
+            if kind == "text_prompt":
+                rendered_prompt["text_prompt"] = value
+        return rendered_prompt
+
+    def render_xml(self, inputs):
+        # Values are escaped by the template as they are written, inputs and data are neither copied nor walked.
+        context = {**self.render_context(False), "input": inputs}
+        if self.frozen is None:
+            rendered_prompt = render_jinja2_xml(self.template["prompt"], **context)
+        else:
+            rendered_prompt = "".join(
+                render_template(segment, **context) if is_dynamic else segment for is_dynamic, segment in self.frozen
+            )
         try:
-            rendered_prompt = parse_xml(rendered_prompt)["root"]
+            with span("parse_xml", xml_chars=len(rendered_prompt)):
+                return parse_xml(rendered_prompt)["root"]
         except Exception as e:
             print(rendered_prompt)
             raise e
+
+    def render_prompt(self, inputs={}, inputs_yaml=None, debug=False):
+        if inputs_yaml:
+            with span("load_inputs", path=inputs_yaml):
+                inputs = {**load_yaml_file(inputs_yaml), **inputs}
+        structured = self.structured_prompt is not None
+        with span("render", structured=structured, frozen=self.frozen is not None) as attributes:
+            if structured:
+                rendered_prompt = self.render_messages(inputs)
+            else:
+                rendered_prompt = self.render_xml(inputs)
+            attributes["prompt_chars"] = len(rendered_prompt.get("text_prompt") or "") + sum(
+                len(message["content"] or "") for message in rendered_prompt.get("messages", [])
+            )
         if debug:
             if "messages" in rendered_prompt:
                 print("Messages:")
@@ -108,6 +342,154 @@ class Prompt:
                 print(rendered_prompt["text_prompt"])
         return rendered_prompt
 
+    def render_many(self, inputs_iterable, debug=False):
+        for inputs in inputs_iterable:
+            yield self.render_prompt(inputs, debug=debug)
+
+    def chat_complete_many(
+        self, inputs_iterable, client=None, max_workers=8, rate_limit=None, ordered=True, *args, **kwargs
+    ):
+        """
+        Runs `chat_complete` over many inputs on a thread pool.
+
+        Args:
+            inputs_iterable (iterable): The inputs of each request, consumed lazily.
+            client: The client used for every request, defaults to `default_client`.
+            max_workers (int): The number of requests in flight.
+            rate_limit (float): The maximum number of requests started per second.
+            ordered (bool): Yield results in input order, otherwise as soon as they finish.
+            All the other arguments are passed to `chat_complete`.
+
+        Yields:
+            tuple: (index, result, error) for every input, error being None on success. A failing item
+            does not stop the batch.
+        """
+        rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+
+        def run(inputs):
+            if rate_limiter is not None:
+                rate_limiter.wait()
+            return self.chat_complete(inputs, None, client, False, *args, **kwargs)
+
+        def outcome(index, future):
+            try:
+                return index, future.result(), None
+            except Exception as e:
+                return index, None, e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            done = {}
+            next_index = 0
+            inputs_iterator = enumerate(inputs_iterable)
+            exhausted = False
+            while True:
+                # Only keep a bounded window of submitted requests so huge iterables are streamed.
+                while not exhausted and len(pending) + len(done) < max_workers * 4:
+                    try:
+                        index, inputs = next(inputs_iterator)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[executor.submit(run, inputs)] = index
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = pending.pop(future)
+                    if ordered:
+                        done[index] = outcome(index, future)
+                    else:
+                        yield outcome(index, future)
+                while next_index in done:
+                    yield done.pop(next_index)
+                    next_index += 1
+
+    def iterate_responses(self, generator, get_text):
+        if self.stream_output_parsing_function == "compiled":
+            # Parse state is kept across chunks, each chunk only costs its own size.
+            stream_parser = compile_reverse_parser(self.template["output_template"]).stream()
+            for response in generator:
+                yield stream_parser.feed(get_text(response) or "")
+            yield self.close_stream(stream_parser)
+        else:
+            response_text = ""
+            for response in generator:
+                response_text += get_text(response) or ""
+                yield self.stream_output_parsing_function(response_text)
+
+    async def aiterate_responses(self, request, get_text):
+        # The request is only sent when the iteration starts, and the concurrency slot is held until the
+        # stream is exhausted or closed.
+        async with self.semaphore():
+            generator = await request()
+            if self.stream_output_parsing_function == "compiled":
+                stream_parser = compile_reverse_parser(self.template["output_template"]).stream()
+                async for response in generator:
+                    yield stream_parser.feed(get_text(response) or "")
+                yield self.close_stream(stream_parser)
+            else:
+                response_text = ""
+                async for response in generator:
+                    response_text += get_text(response) or ""
+                    yield self.stream_output_parsing_function(response_text)
+
+    def close_stream(self, stream_parser):
+        try:
+            return stream_parser.close()
+        except ValueError:
+            return self.reverse_template("".join(stream_parser.chunks), self.template["output_template"], self.cache)
+
+    async def areverse_template(self, response):
+        if self.reverse_template is reverse_template_llm_parse:
+            return await areverse_template_llm_parse(response, self.template["output_template"], self.cache)
+        if self.reverse_template is reverse_template_compiled:
+            return await areverse_template_compiled(response, self.template["output_template"], self.cache)
+        if asyncio.iscoroutinefunction(self.reverse_template):
+            return await self.reverse_template(response, self.template["output_template"], self.cache)
+        # Code generation and custom parsers are blocking, keep them off the event loop.
+        return await asyncio.to_thread(self.reverse_template, response, self.template["output_template"], self.cache)
+
+    def semaphore(self):
+        if self.max_concurrency is None:
+            return get_semaphore() or contextlib.nullcontext()
+        # A semaphore only works with one event loop, each running loop gets its own.
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def response_cache_key(self, prompt, chat_complete_args):
+        if self.response_cache is None:
+            return None
+        return self.response_cache.key(prompt, chat_complete_args)
+
+    def parser_name(self):
+        return getattr(self.reverse_template, "__name__", "custom")
+
+    def parse_response(self, response, output_as_yaml=False):
+        try:
+            with span("parse", parser=self.parser_name(), response_chars=len(response or "")):
+                result = self.reverse_template(response, self.template["output_template"], self.cache)
+            if output_as_yaml:
+                return convert_dict_to_yaml(result)
+            else:
+                return result
+        except Exception as e:
+            raise Exception(f'Error "{e}" while parsing the response:\n{response}')
+
+    async def aparse_response(self, response, output_as_yaml=False):
+        try:
+            with span("parse", parser=self.parser_name(), response_chars=len(response or "")):
+                result = await self.areverse_template(response)
+            if output_as_yaml:
+                return convert_dict_to_yaml(result)
+            else:
+                return result
+        except Exception as e:
+            raise Exception(f'Error "{e}" while parsing the response:\n{response}')
+
     def chat_complete(
         self, inputs=None, inputs_yaml=None, client=None, debug=False, output_as_yaml=False, *args, **kwargs
     ):
@@ -115,58 +497,134 @@ class Prompt:
             client = self.default_client
         rendered_prompt = self.render_prompt(inputs, inputs_yaml, debug)
         chat_complete_args = {**self.default_chat_complete_args, **kwargs}
-        response = client.chat.completions.create(messages=rendered_prompt["messages"], *args, **chat_complete_args)
-        if debug:
-            print("Response:")
-            print(response)
-        try:
+        cache_key = self.response_cache_key(rendered_prompt["messages"], chat_complete_args)
+        response = self.response_cache.get(cache_key) if cache_key else None
+        cached = response is not None
+        if not cached:
+            with span("request", kind="chat", model=chat_complete_args.get("model")) as attributes:
+                response = send_request(
+                    lambda: client.chat.completions.create(
+                        messages=rendered_prompt["messages"], *args, **chat_complete_args
+                    ),
+                    self.request_policy,
+                    hedge=not chat_complete_args.get("stream", False),
+                )
+                record_usage(attributes, response)
+            if debug:
+                print("Response:")
+                print(response)
             if chat_complete_args.get("stream", False):
-
-                def iterate_responses(generator):
-                    response_text = ""
-                    for response in generator:
-                        response_text += response.choices[0].delta.content or ""
-                        yield self.stream_output_parsing_function(response_text)
-
-                return iterate_responses(response)
-            else:
-                response = response.choices[0].message.content
-                result = self.reverse_template(response, self.template["output_template"], self.cache)
-                if output_as_yaml:
-                    return convert_dict_to_yaml(result)
-                else:
-                    return result
-        except Exception as e:
-            raise Exception(f'Error "{e}" while parsing the response:\n{response}')
+                return self.iterate_responses(response, lambda chunk: chunk.choices[0].delta.content)
+            response = response.choices[0].message.content
+        result = self.parse_response(response, output_as_yaml)
+        # Cached once parsed: a response that fails to parse must be requested again on the next call.
+        if cache_key and not cached:
+            self.response_cache.set(cache_key, response)
+        return result
 
     def complete(self, inputs=None, inputs_yaml=None, client=None, debug=False, output_as_yaml=False, *args, **kwargs):
         if client is None:
             client = self.default_client
         rendered_prompt = self.render_prompt(inputs, inputs_yaml, debug)
         chat_complete_args = {**self.default_chat_complete_args, **kwargs}
-        response = client.completions.create(prompt=rendered_prompt["text_prompt"], *args, **chat_complete_args)
-        if debug:
-            print("Response:")
-            print(response)
-        try:
+        cache_key = self.response_cache_key(rendered_prompt["text_prompt"], chat_complete_args)
+        response = self.response_cache.get(cache_key) if cache_key else None
+        cached = response is not None
+        if not cached:
+            with span("request", kind="completion", model=chat_complete_args.get("model")) as attributes:
+                response = send_request(
+                    lambda: client.completions.create(
+                        prompt=rendered_prompt["text_prompt"], *args, **chat_complete_args
+                    ),
+                    self.request_policy,
+                    hedge=not chat_complete_args.get("stream", False),
+                )
+                record_usage(attributes, response)
+            if debug:
+                print("Response:")
+                print(response)
             if chat_complete_args.get("stream", False):
+                return self.iterate_responses(response, lambda chunk: chunk.choices[0].delta.text)
+            response = response.choices[0].text
+        result = self.parse_response(response, output_as_yaml)
+        # Cached once parsed: a response that fails to parse must be requested again on the next call.
+        if cache_key and not cached:
+            self.response_cache.set(cache_key, response)
+        return result
 
-                def iterate_responses(generator):
-                    response_text = ""
-                    for response in generator:
-                        response_text += response.choices[0].delta.text or ""
-                        yield self.stream_output_parsing_function(response_text)
+    async def achat_complete(
+        self, inputs=None, inputs_yaml=None, client=None, debug=False, output_as_yaml=False, *args, **kwargs
+    ):
+        if client is None:
+            client = self.default_async_client
+        rendered_prompt = self.render_prompt(inputs, inputs_yaml, debug)
+        chat_complete_args = {**self.default_chat_complete_args, **kwargs}
+        stream = chat_complete_args.get("stream", False)
 
-                return iterate_responses(response)
-            else:
-                response = response.choices[0].text
-                result = self.reverse_template(response, self.template["output_template"], self.cache)
-                if output_as_yaml:
-                    return convert_dict_to_yaml(result)
-                else:
-                    return result
-        except Exception as e:
-            raise Exception(f'Error "{e}" while parsing the response:\n{response}')
+        async def request():
+            with span("request", kind="chat", model=chat_complete_args.get("model")) as attributes:
+                response = await asend_request(
+                    lambda: client.chat.completions.create(
+                        messages=rendered_prompt["messages"], *args, **chat_complete_args
+                    ),
+                    self.request_policy,
+                    hedge=not stream,
+                )
+                record_usage(attributes, response)
+            if debug:
+                print("Response:")
+                print(response)
+            return response
+
+        if stream:
+            return self.aiterate_responses(request, lambda chunk: chunk.choices[0].delta.content)
+        cache_key = self.response_cache_key(rendered_prompt["messages"], chat_complete_args)
+        response = await self.response_cache.aget(cache_key) if cache_key else None
+        async with self.semaphore():
+            cached = response is not None
+            if not cached:
+                response = (await request()).choices[0].message.content
+            result = await self.aparse_response(response, output_as_yaml)
+        if cache_key and not cached:
+            await self.response_cache.aset(cache_key, response)
+        return result
+
+    async def acomplete(
+        self, inputs=None, inputs_yaml=None, client=None, debug=False, output_as_yaml=False, *args, **kwargs
+    ):
+        if client is None:
+            client = self.default_async_client
+        rendered_prompt = self.render_prompt(inputs, inputs_yaml, debug)
+        chat_complete_args = {**self.default_chat_complete_args, **kwargs}
+        stream = chat_complete_args.get("stream", False)
+
+        async def request():
+            with span("request", kind="completion", model=chat_complete_args.get("model")) as attributes:
+                response = await asend_request(
+                    lambda: client.completions.create(
+                        prompt=rendered_prompt["text_prompt"], *args, **chat_complete_args
+                    ),
+                    self.request_policy,
+                    hedge=not stream,
+                )
+                record_usage(attributes, response)
+            if debug:
+                print("Response:")
+                print(response)
+            return response
+
+        if stream:
+            return self.aiterate_responses(request, lambda chunk: chunk.choices[0].delta.text)
+        cache_key = self.response_cache_key(rendered_prompt["text_prompt"], chat_complete_args)
+        response = await self.response_cache.aget(cache_key) if cache_key else None
+        async with self.semaphore():
+            cached = response is not None
+            if not cached:
+                response = (await request()).choices[0].text
+            result = await self.aparse_response(response, output_as_yaml)
+        if cache_key and not cached:
+            await self.response_cache.aset(cache_key, response)
+        return result
 
     def print_as_json(self, inputs=None):
         print(json.dumps(self.render(inputs), indent=2))
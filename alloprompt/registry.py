@@ -0,0 +1,73 @@
+import os
+import threading
+from alloprompt.prompt import Prompt, load_template
+
+
+class PromptRegistry:
+    """
+    Library of prompts stored as `.xml.j2` files in a directory.
+
+    Templates are only read the first time a prompt is requested and are read again only when the file
+    changes (mtime, then content hash). The registry does not change any global setting: to let new workers
+    skip the compilation of the templates, enable the process-wide bytecode cache with
+    `set_bytecode_cache_dir`.
+
+    Args:
+        directory (str): The directory containing the templates, e.g. `example_templates/`.
+        extension (str): The extension of the template files.
+        All the other arguments are used to build every `Prompt` of the registry.
+
+    Example:
+        registry = PromptRegistry("example_templates", default_client=client)
+        registry["generate_question"].chat_complete({"content": text})
+    """
+
+    def __init__(self, directory, extension=".xml.j2", **prompt_kwargs):
+        self.directory = directory
+        self.extension = extension
+        self.prompt_kwargs = prompt_kwargs
+        self.prompts = {}
+        self.lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.directory, name + self.extension)
+
+    def names(self):
+        names = []
+        for root, _, files in os.walk(self.directory):
+            for file in files:
+                if file.endswith(self.extension):
+                    relative = os.path.relpath(os.path.join(root, file), self.directory)
+                    names.append(relative[: -len(self.extension)].replace(os.sep, "/"))
+        return sorted(names)
+
+    def get(self, name, **kwargs):
+        """
+        Returns the prompt `name` (the path of its file relative to the directory, without extension).
+
+        Without arguments, the same `Prompt` is returned until its file changes. With arguments, a new
+        `Prompt` is built on top of the registry arguments, reusing the already split template.
+        """
+        path = self.path(name)
+        if not os.path.isfile(path):
+            raise KeyError(f"No prompt named {name} in {self.directory}")
+        if kwargs:
+            return Prompt(path, **{**self.prompt_kwargs, **kwargs})
+        sections = load_template(path)
+        with self.lock:
+            cached = self.prompts.get(name)
+            if cached is not None and cached[0] is sections:
+                return cached[1]
+        prompt = Prompt(path, **self.prompt_kwargs)
+        with self.lock:
+            self.prompts[name] = (sections, prompt)
+        return prompt
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return os.path.isfile(self.path(name))
+
+    def __iter__(self):
+        return iter(self.names())
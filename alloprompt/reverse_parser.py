@@ -0,0 +1,392 @@
+import re
+from functools import lru_cache
+from jinja2 import Environment, nodes
+
+_parse_env = Environment()
+
+
+class TemplateNotCompilable(ValueError):
+    pass
+
+
+def _expression_path(node):
+    if isinstance(node, nodes.Name):
+        return (node.name,)
+    if isinstance(node, nodes.Getattr):
+        return _expression_path(node.node) + (node.attr,)
+    if isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+        return _expression_path(node.node) + (node.arg.value,)
+    raise TemplateNotCompilable(f"Unsupported expression in output template: {type(node).__name__}")
+
+
+def _flatten(body):
+    """
+    Turns a list of Jinja2 AST nodes into a flat list of parser elements.
+
+    Args:
+        body (list): The Jinja2 nodes of a template or of a for loop body.
+
+    Returns:
+        list: Tuples of ("text", str), ("ws", has_newline), ("var", path) or ("loop", target, iter_path, elements).
+    """
+    elements = []
+
+    def add(element):
+        if elements and element[0] == "ws" and elements[-1][0] == "ws":
+            elements[-1] = ("ws", elements[-1][1] or element[1])
+        elif elements and element[0] == "text" and elements[-1][0] == "text":
+            elements[-1] = ("text", elements[-1][1] + element[1])
+        else:
+            elements.append(element)
+
+    for node in body:
+        if isinstance(node, nodes.Output):
+            for child in node.nodes:
+                if isinstance(child, nodes.TemplateData):
+                    for token in re.findall(r"\s+|\S+", child.data):
+                        add(("ws", "\n" in token) if token.isspace() else ("text", token))
+                else:
+                    add(("var", _expression_path(child)))
+        elif isinstance(node, nodes.For):
+            if node.else_ or node.test is not None or node.recursive or not isinstance(node.target, nodes.Name):
+                raise TemplateNotCompilable("Only plain `{% for item in items %}` loops are supported")
+            add(("loop", node.target.name, _expression_path(node.iter), _flatten(node.body)))
+        else:
+            raise TemplateNotCompilable(f"Unsupported statement in output template: {type(node).__name__}")
+    return elements
+
+
+class _Sequence:
+    def __init__(self, elements, line_start=True, line_end=True):
+        self.lead_newline = bool(elements) and elements[0][0] == "ws" and elements[0][1]
+        self.trail_newline = bool(elements) and elements[-1][0] == "ws" and elements[-1][1]
+        if elements and elements[0][0] == "ws":
+            elements = elements[1:]
+        if elements and elements[-1][0] == "ws":
+            elements = elements[:-1]
+        self.elements = []
+        for i, element in enumerate(elements):
+            if element[0] == "loop":
+                body = _Sequence(element[3], line_start=False, line_end=False)
+                self.elements.append(("loop", element[1], element[2], body))
+            else:
+                self.elements.append(element)
+            if element[0] == "var" and i + 1 < len(elements) and elements[i + 1][0] == "var":
+                raise TemplateNotCompilable("Two consecutive variables cannot be told apart")
+        self.line_start = line_start
+        self.line_end = line_end
+
+    def compile(self, follow):
+        """
+        Builds the patterns of the sequence.
+
+        Args:
+            follow (str): The pattern of what may come right after the sequence, used to close loop items.
+        """
+        self.follow = follow
+        for i, element in enumerate(self.elements):
+            if element[0] == "loop":
+                body = element[3]
+                body.compile(f"{body.junction}{body.head(0, None)}|{self.head(i + 1, follow)}")
+                body.item_regex = re.compile(body.item_pattern)
+                body.next_item_regex = re.compile(f"{body.junction}{body.item_pattern}")
+        self.pattern = "".join(self.element_pattern(i, True) for i in range(len(self.elements)))
+        self.pattern_no_capture = "".join(self.element_pattern(i, False) for i in range(len(self.elements)))
+        self.item_pattern = f"(?>{self.pattern}(?={self.follow}))"
+
+    def head(self, i, follow):
+        """
+        Pattern of the elements from i up to the next loop, then of the start of its first item or of what
+        follows it, and `follow` once the end of the sequence is reached. Used in lookaheads to recognize where
+        a loop item ends.
+        """
+        pattern = ""
+        for j in range(i, len(self.elements)):
+            element = self.elements[j]
+            if element[0] == "loop":
+                # Either a first item starts here or the loop is empty.
+                return pattern + f"(?:{element[3].head(0, None)}|{self.head(j + 1, follow)})"
+            pattern += self.element_pattern(j, False)
+        return pattern + (f"(?:{follow})" if follow is not None else "")
+
+    def element_pattern(self, i, capture):
+        element = self.elements[i]
+        previous = self.elements[i - 1] if i > 0 else None
+        following = self.elements[i + 1] if i + 1 < len(self.elements) else None
+        if element[0] == "text":
+            return re.escape(element[1])
+        if element[0] == "ws":
+            next_to_loop = (previous and previous[0] == "loop") or (following and following[0] == "loop")
+            return r"[ \t]*\n\s*" if element[1] and not next_to_loop else r"\s*"
+        if element[0] == "var":
+            # A variable alone on its line is allowed to span several lines.
+            alone_before = (previous is None and self.line_start) or (previous and previous == ("ws", True))
+            alone_after = (following is None and self.line_end) or (following and following == ("ws", True))
+            value = r"[\s\S]*?" if alone_before and alone_after else r"[^\n]*?"
+            return f"(?P<v{i}>{value})" if capture else f"(?:{value})"
+        # Items are atomic and repeated possessively: an item is kept as soon as it is followed by another
+        # item or by what follows the loop, so a mismatch fails in linear time instead of backtracking
+        # through every way of splitting the items.
+        loop = element[3]
+        item = f"(?>{loop.pattern_no_capture}(?={loop.follow}))"
+        repeated = f"(?:{item}(?:{loop.junction}{item})*+)?+"
+        return f"(?P<l{i}>{repeated})" if capture else repeated
+
+    @property
+    def junction(self):
+        return r"[ \t]*\n\s*" if self.lead_newline or self.trail_newline else r"\s*"
+
+    def split_items(self, string, start, end):
+        """Matches the items of a loop spanning `string[start:end]` one by one, like the loop pattern does."""
+        items = []
+        position = start
+        regex = self.item_regex
+        while position < end:
+            match = regex.match(string, position)
+            if match is None or match.end() > end:
+                raise ValueError("The response does not match the output template")
+            items.append(match)
+            position = match.end()
+            regex = self.next_item_regex
+        return items
+
+    def extract(self, match, scopes):
+        for i, element in enumerate(self.elements):
+            if element[0] == "var":
+                _assign(scopes, element[1], match.group(f"v{i}").strip())
+            elif element[0] == "loop":
+                _, target, iter_path, body = element
+                items = []
+                for item_match in body.split_items(match.string, match.start(f"l{i}"), match.end(f"l{i}")):
+                    box = [{}]
+                    body.extract(item_match, scopes + [(target, box)])
+                    items.append(box[0])
+                _assign(scopes, iter_path, items)
+
+
+def _assign(scopes, path, value):
+    if path[0] == "loop":
+        return
+    for target, box in reversed(scopes[1:]):
+        if target == path[0]:
+            if len(path) == 1:
+                box[0] = value
+            else:
+                _set_path(box[0], path[1:], value)
+            return
+    _set_path(scopes[0][1][0], path, value)
+
+
+def _set_path(values, path, value):
+    if not isinstance(values, dict):
+        raise ValueError("The response does not match the output template")
+    for key in path[:-1]:
+        values = values.setdefault(key, {})
+        if not isinstance(values, dict):
+            raise ValueError("The response does not match the output template")
+    values[path[-1]] = value
+
+
+class ReverseParser:
+    """
+    Deterministic parser turning a rendered output template back into its context.
+
+    The parser is compiled once from the Jinja2 AST of the output template. Literal text is matched
+    with whitespace tolerance, `{{ var.attr }}` outputs become captures and `{% for %}` loops become
+    repeated groups whose items are extracted one by one.
+    """
+
+    def __init__(self, template):
+        ast = _parse_env.parse(template)
+        self.sequence = _Sequence(_flatten(ast.body))
+        self.sequence.compile(r"\s*\Z")
+        self.regex = re.compile(rf"\s*{self.sequence.pattern}\s*")
+
+    def parse(self, rendered_template):
+        """
+        Args:
+            rendered_template (str): The text produced by the language model.
+
+        Returns:
+            dict: The extracted values, with the same shape as the context of the output template.
+
+        Raises:
+            ValueError: If the text does not follow the output template.
+        """
+        match = self.regex.fullmatch(rendered_template)
+        if match is None:
+            raise ValueError("The response does not match the output template")
+        values = [{}]
+        self.sequence.extract(match, [(None, values)])
+        return values[0]
+
+    def stream(self):
+        return StreamParser(self)
+
+
+class StreamParser:
+    """
+    Incremental counterpart of `ReverseParser.parse` for streamed responses.
+
+    Only the part of the response that has not been matched yet is kept and rescanned, so the cost of a
+    chunk is bounded by the size of the chunk and of the item currently open, not by the length of the
+    whole response. Top-level loop items are added to the result as soon as they are closed.
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.sequence = parser.sequence
+        self.values = [{}]
+        self.scopes = [(None, self.values)]
+        self.chunks = []
+        self.tail = ""
+        self.index = 0
+        self.items = None
+        self.failed = False
+        self.complete = False
+        self._regexes = {}
+
+    def _regex(self, key, build):
+        if key not in self._regexes:
+            self._regexes[key] = re.compile(build())
+        return self._regexes[key]
+
+    def _next_text(self, i):
+        """Pattern of the (optional) whitespace and literal text starting at element i, or None."""
+        elements = self.sequence.elements
+        if i < len(elements) and elements[i][0] == "ws":
+            if i + 1 < len(elements) and elements[i + 1][0] == "text":
+                return self.sequence.element_pattern(i, False) + self.sequence.element_pattern(i + 1, False)
+            return None
+        if i < len(elements) and elements[i][0] == "text":
+            return self.sequence.element_pattern(i, False)
+        return None
+
+    def feed(self, chunk):
+        """
+        Args:
+            chunk (str): The next piece of the response.
+
+        Returns:
+            dict: The values extracted so far.
+        """
+        self.chunks.append(chunk)
+        self.tail += chunk
+        if self.index == 0:
+            self.tail = self.tail.lstrip()
+        self._advance(False)
+        return dict(self.values[0])
+
+    def close(self):
+        """
+        Finishes the parsing once the stream is over.
+
+        Returns:
+            dict: The values extracted from the whole response.
+
+        Raises:
+            ValueError: If the response does not follow the output template.
+        """
+        self._advance(True)
+        if not self.complete:
+            return self.parser.parse("".join(self.chunks))
+        return self.values[0]
+
+    def _advance(self, final):
+        elements = self.sequence.elements
+        while not self.failed and self.index < len(elements):
+            element = elements[self.index]
+            if element[0] == "text":
+                if self.tail.startswith(element[1]):
+                    self.tail = self.tail[len(element[1]) :]
+                    self.index += 1
+                    continue
+                if final or not element[1].startswith(self.tail):
+                    self.failed = True
+                return
+            if element[0] == "ws":
+                regex = self._regex(("ws", self.index), lambda: self.sequence.element_pattern(self.index, False))
+                match = regex.match(self.tail)
+                if match is None:
+                    self.failed = final or self.tail.strip() != ""
+                    return
+                if match.end() == len(self.tail) and not final:
+                    return
+                self.tail = self.tail[match.end() :]
+                self.index += 1
+                continue
+            if element[0] == "var":
+                follow = self._next_text(self.index + 1)
+                if follow is None:
+                    # Only the last element can be closed by the end of the stream.
+                    if not final or self.index + 1 < len(elements):
+                        return
+                    _assign(self.scopes, element[1], self.tail.strip())
+                    self.tail = ""
+                    self.index += 1
+                    continue
+                regex = self._regex(("var", self.index), lambda: rf"(?P<value>[\s\S]*?)(?={follow})")
+                match = regex.match(self.tail)
+                if match is None:
+                    self.failed = final
+                    return
+                _assign(self.scopes, element[1], match.group("value").strip())
+                self.tail = self.tail[match.end() :]
+                self.index += 1
+                continue
+            if not self._advance_loop(element, final):
+                return
+        self.complete = final and not self.failed and self.index == len(elements) and self.tail.strip() == ""
+
+    def _advance_loop(self, element, final):
+        _, target, iter_path, body = element
+        if self.items is None:
+            self.items = []
+            _assign(self.scopes, iter_path, self.items)
+        after = self._next_text(self.index + 1)
+        is_last = self.index + 1 == len(self.sequence.elements)
+
+        def build_item_pattern(first):
+            lookahead = f"{body.junction}{body.pattern_no_capture}"
+            if after is not None:
+                lookahead += rf"|\s*{after}"
+            if final or is_last:
+                lookahead += r"|\s*\Z" if final else ""
+            junction = "" if first else body.junction
+            return f"{junction}(?>{body.pattern}(?={lookahead}))"
+
+        while True:
+            first = len(self.items) == 0
+            regex = self._regex(("item", self.index, first, final), lambda: build_item_pattern(first))
+            match = regex.match(self.tail)
+            if match is None:
+                break
+            box = [{}]
+            body.extract(match, self.scopes + [(target, box)])
+            self.items.append(box[0])
+            self.tail = self.tail[match.end() :]
+        if after is not None:
+            if self._regex(("after", self.index), lambda: rf"\s*{after}").match(self.tail):
+                self.items = None
+                self.index += 1
+                return True
+        elif final and is_last and self.tail.strip() == "":
+            self.items = None
+            self.index += 1
+            return True
+        self.failed = final
+        return False
+
+
+@lru_cache(maxsize=256)
+def compile_reverse_parser(template):
+    """
+    Compiles (and caches) the reverse parser of an output template.
+
+    Returns:
+        ReverseParser or None: None when the template uses constructs the parser does not support.
+    """
+    try:
+        return ReverseParser(template)
+    except TemplateNotCompilable:
+        return None
@@ -1,25 +1,201 @@
+import os
+import re
 import sys
+import math
+import asyncio
 import yaml
 import json
+import time
+import hashlib
+import weakref
 import tempfile
+import linecache
+import threading
 import xmltodict
 import traceback
-from jinja2 import Environment, FileSystemLoader
+import contextlib
+import multiprocessing
+import multiprocessing.connection
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from markupsafe import Markup, escape
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, nodes, select_autoescape
+from alloprompt.reverse_parser import compile_reverse_parser
+from alloprompt.instrumentation import span, event
+
+try:
+    import fcntl
+    import resource
+except ImportError:
+    fcntl = None
+    resource = None
 
 code_gen_client = None
 parse_client = None
+async_parse_client = None
+max_concurrency = None
+_semaphores = weakref.WeakKeyDictionary()
 code_gen_model = "gpt-4-turbo-preview"
 parse_model = "gpt-3.5-turbo"
+code_gen_candidates = 3
+code_test_timeout = 10
+request_policy = None
+parse_batcher = None
+cache_dir = os.environ.get("ALLOPROMPT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "alloprompt"))
 
 
-def render_jinja2(template_str, **kwargs):
-    env = Environment(loader=FileSystemLoader("/"))
-    with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp_file:
-        temp_file.write(template_str)
-        temp_file.seek(0)
-        temp_path = temp_file.name
-        template = env.get_template(temp_path)
+# Templates compiled under a ".xml" name escape their output: values are escaped lazily, when written
+# into the XML, instead of escaping a copy of every input beforehand.
+_jinja_env = Environment(
+    loader=FileSystemLoader("/"), autoescape=select_autoescape(enabled_extensions=("xml",), default_for_string=False)
+)
+_template_cache = OrderedDict()
+_template_cache_lock = threading.Lock()
+template_cache_size = 256
+
+
+def set_template_cache_size(size):
+    global template_cache_size
+    template_cache_size = size
+    with _template_cache_lock:
+        while len(_template_cache) > template_cache_size:
+            _template_cache.popitem(last=False)
+
+
+def set_bytecode_cache_dir(path):
+    """
+    Stores the compiled bytecode of every template of the process in `path` (None disables it), so that new
+    processes skip the compilation, e.g. `set_bytecode_cache_dir(os.path.join(cache_dir, "jinja"))`.
+    """
+    if path is None:
+        _jinja_env.bytecode_cache = None
+    else:
+        os.makedirs(path, exist_ok=True)
+        _jinja_env.bytecode_cache = FileSystemBytecodeCache(path)
+
+
+def _forget_template_source(filename, entry):
+    if linecache.cache.get(filename) is entry:
+        del linecache.cache[filename]
+
+
+def compile_template(source, key, text=None):
+    """
+    Compiles a template source (or AST) under a pseudo filename.
+
+    Each compiled template gets its own pseudo filename so that the traceback filtering in render_template can
+    tell its frames apart from Jinja's internals. `text` (by default `source` itself) is registered in
+    `linecache` under that filename while the template lives, so tracebacks show the template lines.
+    """
+    filename = f"<template {key[:16]}{key[64:]}>"
+    bytecode_cache = _jinja_env.bytecode_cache
+    if bytecode_cache is None or not isinstance(source, str):
+        code = _jinja_env.compile(source, name=key, filename=filename)
+    else:
+        bucket = bytecode_cache.get_bucket(_jinja_env, key, filename, source)
+        code = bucket.code
+        if code is None:
+            code = _jinja_env.compile(source, name=key, filename=filename)
+            bucket.code = code
+            bytecode_cache.set_bucket(bucket)
+    template = _jinja_env.template_class.from_code(_jinja_env, code, _jinja_env.make_globals(None))
+    text = source if text is None else text
+    entry = (len(text), None, text.splitlines(True), filename)
+    linecache.cache[filename] = entry
+    weakref.finalize(template, _forget_template_source, filename, entry)
+    return template
+
+
+def template_key(template_str, escape=False):
+    key = hashlib.sha256(template_str.encode("utf-8")).hexdigest()
+    return key + ".xml" if escape else key
+
+
+def get_compiled_template(template_str, escape=False):
+    key = template_key(template_str, escape)
+    with _template_cache_lock:
+        template = _template_cache.get(key)
+        if template is not None:
+            _template_cache.move_to_end(key)
+            event("template_cache", hit=True)
+            return template
+    event("template_cache", hit=False)
+    with span("compile_template", template_chars=len(template_str)):
+        template = compile_template(template_str, key)
+    with _template_cache_lock:
+        _template_cache[key] = template
+        _template_cache.move_to_end(key)
+        while len(_template_cache) > template_cache_size:
+            _template_cache.popitem(last=False)
+    return template
+
+
+_scope_changing_nodes = (
+    nodes.Assign,
+    nodes.AssignBlock,
+    nodes.Macro,
+    nodes.Import,
+    nodes.FromImport,
+    nodes.Extends,
+    nodes.Block,
+)
+# Extends and blocks change the whole template wherever they are, definitions only in their scope.
+_scoped_definition_nodes = (nodes.Assign, nodes.AssignBlock, nodes.Macro, nodes.Import, nodes.FromImport)
+# Names defined inside these nodes do not leak into the rest of the template.
+_scoping_nodes = (nodes.For, nodes.Macro, nodes.CallBlock, nodes.FilterBlock, nodes.With)
+
+
+def _changes_scope(node, scoped=False):
+    # True when `node` defines names visible outside of it, e.g. a `{% set %}` inside an `{% if %}`.
+    if isinstance(node, _scope_changing_nodes) and not (scoped and isinstance(node, _scoped_definition_nodes)):
+        return True
+    scoped = scoped or isinstance(node, _scoping_nodes)
+    return any(_changes_scope(child, scoped) for child in node.iter_child_nodes())
+
+
+def split_template(template_str, dynamic_names=("input",), escape=False):
+    """
+    Splits a template into consecutive top-level segments that do or do not use the dynamic names.
+
+    Args:
+        template_str (str): The Jinja2 template.
+        dynamic_names (tuple): The variables only known at render time.
+        escape (bool): Whether the segments XML-escape their output.
 
+    Returns:
+        list: (is_dynamic, compiled template) tuples, in template order, or None when the template
+        defines variables, macros or blocks outside of a loop, macro or call block and cannot be split.
+    """
+    ast = _jinja_env.parse(template_str)
+    if _changes_scope(ast):
+        return None
+    top_level = []
+    for node in ast.body:
+        if isinstance(node, nodes.Output):
+            top_level.extend(nodes.Output([child], lineno=child.lineno) for child in node.nodes)
+        else:
+            top_level.append(node)
+
+    groups = []
+    for node in top_level:
+        is_dynamic = any(name.name in dynamic_names for name in node.find_all(nodes.Name))
+        if groups and groups[-1][0] == is_dynamic:
+            groups[-1][1].append(node)
+        else:
+            groups.append((is_dynamic, [node]))
+
+    key = hashlib.sha256(template_str.encode("utf-8")).hexdigest()
+    extension = ".xml" if escape else ""
+    segments = []
+    for i, (is_dynamic, body) in enumerate(groups):
+        segment = nodes.Template(body, lineno=1)
+        segment.set_environment(_jinja_env)
+        segments.append((is_dynamic, compile_template(segment, f"{key}-{i}{extension}", template_str)))
+    return segments
+
+
+def render_template(template, **kwargs):
     try:
         rendered = template.render(**kwargs)
         return rendered
@@ -27,7 +203,7 @@ def render_jinja2(template_str, **kwargs):
         _, __, exc_traceback = sys.exc_info()
         traceback_lines = traceback.extract_tb(exc_traceback)
 
-        filtered_traceback = [line for line in traceback_lines if line.filename == temp_path]
+        filtered_traceback = [line for line in traceback_lines if line.filename == template.filename]
 
         if len(filtered_traceback) == 0:
             raise Exception("\n".join(traceback.format_list(traceback_lines)))
@@ -35,6 +211,15 @@ def render_jinja2(template_str, **kwargs):
         raise Exception("\n".join(traceback.format_list(filtered_traceback)))
 
 
+def render_jinja2(template_str, **kwargs):
+    return render_template(get_compiled_template(template_str), **kwargs)
+
+
+def render_jinja2_xml(template_str, **kwargs):
+    """Renders a template into XML, escaping every value it outputs, and returns it as `Markup`."""
+    return Markup(render_template(get_compiled_template(template_str, escape=True), **kwargs))
+
+
 def parse_xml(xml):
     try:
         doc = xmltodict.parse(xml)
@@ -69,12 +254,98 @@ def set_client_llm(client):
     parse_client = client
 
 
+def set_async_parse_client(client):
+    global async_parse_client
+    async_parse_client = client
+
+
+def set_max_concurrency(limit):
+    global max_concurrency
+    global _semaphores
+    max_concurrency = limit
+    _semaphores = weakref.WeakKeyDictionary()
+
+
+def get_semaphore():
+    # A semaphore only works with one event loop, each running loop gets its own.
+    if max_concurrency is None:
+        return None
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(max_concurrency)
+    return semaphore
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing out calls to at most `rate` per second.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            scheduled = max(self.next_time, now)
+            self.next_time = scheduled + self.interval
+        if scheduled > now:
+            time.sleep(scheduled - now)
+
+
+def set_request_policy(policy):
+    global request_policy
+    request_policy = policy
+
+
+def set_parse_batcher(batcher):
+    """Coalesces the LLM parse calls with a `ParseBatcher`, or parses each response on its own with None."""
+    global parse_batcher
+    parse_batcher = batcher
+
+
+def send_request(create, policy=None, hedge=True):
+    """Calls `create` following the request policy (the global one by default), if any."""
+    policy = policy or request_policy
+    if policy is None:
+        return create()
+    return policy.call(create, hedge)
+
+
+async def asend_request(create, policy=None, hedge=True):
+    policy = policy or request_policy
+    if policy is None:
+        return await create()
+    return await policy.acall(create, hedge)
+
+
+def set_code_gen_candidates(candidates):
+    global code_gen_candidates
+    code_gen_candidates = candidates
+
+
+def set_code_test_timeout(timeout):
+    global code_test_timeout
+    code_test_timeout = timeout
+
+
 def set_code_gen_model(model):
     global code_gen_model
     code_gen_model = model
 
 
-def reverse_template_code(template, additional_messages=[]):
+def extract_code(content):
+    if "```python" in content:
+        return content.split("```python")[1].split("```")[0].strip()
+    if "```" in content:
+        return content.split("```")[1].strip()
+    return content.strip()
+
+
+def reverse_template_code(template, additional_messages=[], n=1):
     if code_gen_client is None:
         raise ValueError("Please set the code_gen_client variable to the ChatCompletion client")
     messages = (
@@ -95,20 +366,22 @@ def reverse_template_code(template, additional_messages=[]):
         + [{"role": "user", "content": template}]
         + additional_messages
     )
-    chat_completion = code_gen_client.chat.completions.create(
-        messages=messages, model=code_gen_model, temperature=0, max_tokens=2048
-    )
-    if "```python" in chat_completion.choices[0].message.content:
-        return chat_completion.choices[0].message.content.split("```python")[1].split("```")[0].strip()
-    if "```" in chat_completion.choices[0].message.content:
-        return chat_completion.choices[0].message.content.split("```")[1].strip()
-    return chat_completion.choices[0].message.content.strip()
+    # Several candidates are only useful if they differ, sample them.
+    sampling = {} if n == 1 else {"n": n, "temperature": 0.8}
+    with span("code_gen", model=code_gen_model, repair=bool(additional_messages), candidates=n) as attributes:
+        chat_completion = code_gen_client.chat.completions.create(
+            messages=messages, model=code_gen_model, **{"temperature": 0, "max_tokens": 2048, **sampling}
+        )
+        record_usage(attributes, chat_completion)
+    if n == 1:
+        return extract_code(chat_completion.choices[0].message.content)
+    return [extract_code(choice.message.content) for choice in chat_completion.choices]
 
 
-def check_code(code, template, depth=0):
-    if depth > 3:
-        print("Not able to fix !")
-        return code
+def _run_code_test(code, cpu_limit, connection):
+    # Runs in a separate process: a crashing, hanging or CPU hungry `test` cannot affect the caller.
+    if resource is not None and cpu_limit is not None:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
     captured_print = []
 
     def capture_print(*args, **kwargs):
@@ -118,84 +391,340 @@ def check_code(code, template, depth=0):
     try:
         functions = {}
         functions["print"] = capture_print
-        code = "import re\nimport json\n" + code
-        exec(code, functions)
+        exec("import re\nimport json\n" + code, functions)
         functions["test"]()
-    except Exception:
+        connection.send((True, "\n".join(captured_print)))
+    except BaseException:
+        captured_print.append(str(traceback.format_exc()))
+        connection.send((False, "\n".join(captured_print)))
+    finally:
+        connection.close()
+
+
+def run_candidate_tests(candidates, timeout=None, cpu_limit=None):
+    """
+    Runs the `test` function of every candidate in its own process, all in parallel.
+
+    Args:
+        candidates (list): The generated codes.
+        timeout (float): Seconds given to the candidates, defaults to `code_test_timeout`.
+        cpu_limit (int): CPU seconds allowed per process, defaults to `code_test_timeout`.
+
+    Returns:
+        tuple: (code, failures) where code is the first candidate whose test passed (None if none did) and
+        failures the list of (code, output) of the candidates that failed before.
+    """
+    timeout = code_test_timeout if timeout is None else timeout
+    cpu_limit = int(math.ceil(timeout)) if cpu_limit is None else cpu_limit
+    # Spawned processes would import the caller's __main__ again, fork when the platform allows it.
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(start_method)
+    running = {}
+    for code in candidates:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_code_test, args=(code, cpu_limit, sender), daemon=True)
+        process.start()
+        sender.close()
+        running[receiver] = (code, process)
+
+    failures = []
+    passed = None
+    deadline = time.monotonic() + timeout
+    try:
+        while running and passed is None:
+            ready = multiprocessing.connection.wait(list(running), timeout=max(0, deadline - time.monotonic()))
+            if not ready:
+                break
+            for receiver in ready:
+                code, process = running.pop(receiver)
+                try:
+                    success, output = receiver.recv()
+                except EOFError:
+                    success, output = False, f"The test process died with exit code {process.exitcode}"
+                if success and passed is None:
+                    passed = code
+                elif not success:
+                    failures.append((code, output))
+    finally:
+        for receiver, (code, process) in running.items():
+            process.terminate()
+            if passed is None:
+                failures.append((code, f"Timeout: the test did not finish within {timeout} seconds"))
+        # A test may ignore SIGTERM: it is killed if it is still running after a short grace period.
+        grace_deadline = time.monotonic() + 1
+        for receiver, (code, process) in running.items():
+            process.join(max(0, grace_deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+            receiver.close()
+    return passed, failures
+
+
+def repair_messages(code, output):
+    return [
+        {"role": "assistant", "content": "```python\n" + code + "\n```"},
+        {
+            "role": "user",
+            "content": "test_output:\n" + output,
+        },
+    ]
+
+
+def set_cache_dir(path):
+    global cache_dir
+    cache_dir = path
+
+
+_reverse_functions = {}
+_reverse_locks = {}
+_reverse_locks_lock = threading.Lock()
+
+
+def reverse_code_key(template):
+    return hashlib.sha256(f"{code_gen_model}\0{template}".encode("utf-8")).hexdigest()
+
+
+def write_file_atomic(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def generate_reverse_code(template):
+    """
+    Generates `code_gen_candidates` candidates at once, tests them in parallel in separate processes and
+    keeps the first that passes. Failing candidates are repaired in parallel, for up to 4 rounds.
+
+    Returns:
+        tuple: The code and whether its `test` function passed. When no candidate passes, the first
+        untested repair is returned.
+    """
+    candidates = reverse_template_code(template, n=code_gen_candidates)
+    if code_gen_candidates == 1:
+        candidates = [candidates]
+    for depth in range(4):
+        with span("test_code", candidates=len(candidates), depth=depth) as attributes:
+            passed, failures = run_candidate_tests(candidates)
+            attributes["passed"] = passed is not None
+        if passed is not None:
+            return passed, True
+        event("code_repair", depth=depth, candidates=len(failures))
         print("Error, rewriting the code ...")
-        import traceback
+        with ThreadPoolExecutor(max_workers=len(failures)) as executor:
+            candidates = list(
+                executor.map(lambda failure: reverse_template_code(template, repair_messages(*failure)), failures)
+            )
+    print("Not able to fix !")
+    return candidates[0], False
 
-        captured_print.append(str(traceback.format_exc()))
-        print("\n".join(captured_print))
-        code = reverse_template_code(
-            template,
-            [
-                {"role": "assistant", "content": "```python\n" + code + "\n```"},
-                {
-                    "role": "user",
-                    "content": "test_output:\n" + "\n".join(captured_print),
-                },
-            ],
-        )
-        print("Rewritting the code ...")
-        return check_code(code, template, depth + 1)
-    return code
 
+def get_reverse_function(template, cache={}):
+    """
+    Returns the compiled `reverse` function of an output template.
 
-def reverse_template_auto(rendered_template, template, cache={}):
-    if template in cache:
-        code = cache[template]
-    else:
-        code = reverse_template_code(template)
-        for i in range(3):
-            code = check_code(code, template)
+    The generated code is looked up in `cache`, then in the on-disk cache shared by every process using
+    the same `cache_dir`, and only generated when missing. The compiled function is kept in memory so
+    code generation and `exec` happen once per template. Only code whose `test` passed is written to
+    disk: a failing parser is used by this process only, and the next process generates it again.
+    """
+    key = reverse_code_key(template)
+    if key in _reverse_functions:
+        event("reverse_code_cache", source="memory")
+        return _reverse_functions[key]
+    with _reverse_locks_lock:
+        lock = _reverse_locks.setdefault(key, threading.Lock())
+    with lock:
+        if key in _reverse_functions:
+            return _reverse_functions[key]
+        code = cache.get(template)
+        if code is None and cache_dir is not None:
+            code_path = os.path.join(cache_dir, "reverse_code", f"{key}.py")
+            # The file lock makes concurrent processes wait for the first one instead of generating again.
+            with file_lock(code_path + ".lock"):
+                if os.path.exists(code_path):
+                    event("reverse_code_cache", source="disk")
+                    with open(code_path, "r") as file:
+                        code = file.read()
+                else:
+                    event("reverse_code_cache", source="generated")
+                    code, passed = generate_reverse_code(template)
+                    if passed:
+                        write_file_atomic(code_path, code)
+        elif code is None:
+            code, _ = generate_reverse_code(template)
         cache[template] = code
 
-    functions = {}
-    code = "import re\nimport json\n" + code
-    exec(code, functions)
+        functions = {}
+        exec("import re\nimport json\n" + code, functions)
+        _reverse_functions[key] = functions["reverse"]
+    return _reverse_functions[key]
+
 
-    return functions["reverse"](rendered_template)
+def reverse_template_auto(rendered_template, template, cache={}):
+    return get_reverse_function(template, cache)(rendered_template)
+
+
+def llm_parse_messages(rendered_template, template):
+    return [
+        {
+            "role": "system",
+            "content": 'Your task is given a Jinja2 template and a rendered output, return the JSON representation of the template.\n      The JSON must have the format: {"values": {~json of the extracted variables~}}',
+        },
+        {
+            "role": "user",
+            "content": "Jinja2 template:\n      Grocery List:\n{% for item in grocery_list %}\n- {{item.name}}: {{item.quantity}} (Brand: {{item.brand}})\n{% endfor %}\n      Rendered output:\n      \nGrocery List:\n- Milk: 2 liters (Brand: Dairy Fresh)\n- Bread: 1 loaf (Brand: Baker's Delight)\n- Apples: 5 (Brand: Orchard Pure)",
+        },
+        {
+            "role": "assistant",
+            "content": '{"values":  {"grocery_list": [{"name": "Milk", "quantity": "2 liters", "brand": "Dairy Fresh"}, {"name": "Bread", "quantity": "1 loaf", "brand": "Baker\'s Delight"}, {"name": "Apples", "quantity": "5", "brand": "Orchard Pure"}]} }',
+        },
+        {
+            "role": "user",
+            "content": "Jinja2 template:\n      settings:\n  brightness: {{ brightness }}\n  contrast: {{ contrast }}\n  hue: {{ hue }}\n  saturation: {{ saturation }}\n      Rendered output:\n      \nsettings:\n  brightness: 50\n  contrast: 70\n  hue: 0\n  saturation: 40",
+        },
+        {
+            "role": "assistant",
+            "content": '{"values":  {"brightness": 50, "contrast": 70, "hue": 0, "saturation": 40} }',
+        },
+        {
+            "role": "user",
+            "content": f"Jinja2 template:\n{template}\nRendered output:\n{rendered_template}",
+        },
+    ]
+
+
+def record_usage(attributes, response):
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            if getattr(usage, key, None) is not None:
+                attributes[key] = getattr(usage, key)
+
+
+def llm_parse_batch_messages(items):
+    """
+    Messages asking to parse several (rendered_template, template) pairs at once. The few-shot examples of
+    `llm_parse_messages` are merged into a single batched example.
+    """
+    examples = llm_parse_messages("", "")[1:-1]
+    example_inputs = [message["content"] for message in examples[0::2]]
+    example_outputs = [
+        {"item": i + 1, "values": json.loads(message["content"])["values"]} for i, message in enumerate(examples[1::2])
+    ]
+    return [
+        {
+            "role": "system",
+            "content": 'Your task is given numbered items, each made of a Jinja2 template and a rendered output, return the JSON representation of the template of every item.\n      The JSON must have the format: {"items": [{"item": 1, "values": {~json of the extracted variables of item 1~}}, ...]} with one entry per item, in the same order, each entry giving the number of its item.',
+        },
+        {
+            "role": "user",
+            "content": "\n\n".join(f"Item {i + 1}:\n{content}" for i, content in enumerate(example_inputs)),
+        },
+        {
+            "role": "assistant",
+            "content": json.dumps({"items": example_outputs}),
+        },
+        {
+            "role": "user",
+            "content": "\n\n".join(
+                f"Item {i + 1}:\nJinja2 template:\n{template}\nRendered output:\n{rendered_template}"
+                for i, (rendered_template, template) in enumerate(items)
+            ),
+        },
+    ]
+
+
+def llm_parse_request(messages, **attributes):
+    """Sends a JSON mode parse request and returns the decoded JSON object."""
+    with span("llm_parse", model=parse_model, **attributes) as span_attributes:
+        response = send_request(
+            lambda: parse_client.chat.completions.create(
+                messages=messages,
+                model=parse_model,
+                temperature=0,
+                response_format={"type": "json_object"},
+            )
+        )
+        record_usage(span_attributes, response)
+    return json.loads(response.choices[0].message.content)
+
+
+async def allm_parse_request(messages, **attributes):
+    with span("llm_parse", model=parse_model, **attributes) as span_attributes:
+        response = await asend_request(
+            lambda: async_parse_client.chat.completions.create(
+                messages=messages,
+                model=parse_model,
+                temperature=0,
+                response_format={"type": "json_object"},
+            )
+        )
+        record_usage(span_attributes, response)
+    return json.loads(response.choices[0].message.content)
 
 
 def reverse_template_llm_parse(rendered_template, template, *args, **kwargs):
     if parse_client is None:
         raise ValueError("Please set the code_gen_client variable to the ChatCompletion client")
-    response = parse_client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": 'Your task is given a Jinja2 template and a rendered output, return the JSON representation of the template.\n      The JSON must have the format: {"values": {~json of the extracted variables~}}',
-            },
-            {
-                "role": "user",
-                "content": "Jinja2 template:\n      Grocery List:\n{% for item in grocery_list %}\n- {{item.name}}: {{item.quantity}} (Brand: {{item.brand}})\n{% endfor %}\n      Rendered output:\n      \nGrocery List:\n- Milk: 2 liters (Brand: Dairy Fresh)\n- Bread: 1 loaf (Brand: Baker's Delight)\n- Apples: 5 (Brand: Orchard Pure)",
-            },
-            {
-                "role": "assistant",
-                "content": '{"values":  {"grocery_list": [{"name": "Milk", "quantity": "2 liters", "brand": "Dairy Fresh"}, {"name": "Bread", "quantity": "1 loaf", "brand": "Baker\'s Delight"}, {"name": "Apples", "quantity": "5", "brand": "Orchard Pure"}]} }',
-            },
-            {
-                "role": "user",
-                "content": "Jinja2 template:\n      settings:\n  brightness: {{ brightness }}\n  contrast: {{ contrast }}\n  hue: {{ hue }}\n  saturation: {{ saturation }}\n      Rendered output:\n      \nsettings:\n  brightness: 50\n  contrast: 70\n  hue: 0\n  saturation: 40",
-            },
-            {
-                "role": "assistant",
-                "content": '{"values":  {"brightness": 50, "contrast": 70, "hue": 0, "saturation": 40} }',
-            },
-        ]
-        + [
-            {
-                "role": "user",
-                "content": f"Jinja2 template:\n{template}\nRendered output:\n{rendered_template}",
-            }
-        ],
-        model=parse_model,
-        temperature=0,
-        response_format={"type": "json_object"},
-    )
+    if parse_batcher is not None:
+        return parse_batcher.parse(rendered_template, template)
+    return llm_parse_request(llm_parse_messages(rendered_template, template))["values"]
+
+
+async def areverse_template_llm_parse(rendered_template, template, *args, **kwargs):
+    if async_parse_client is None:
+        raise ValueError("Please set the async_parse_client variable to the async ChatCompletion client")
+    if parse_batcher is not None:
+        return await parse_batcher.aparse(rendered_template, template)
+    return (await allm_parse_request(llm_parse_messages(rendered_template, template)))["values"]
+
+
+def reverse_template_compiled(rendered_template, template, *args, **kwargs):
+    parser = compile_reverse_parser(template)
+    if parser is not None:
+        try:
+            return parser.parse(rendered_template)
+        except ValueError:
+            event("parse_fallback", reason="no_match")
+    else:
+        event("parse_fallback", reason="not_compilable")
+    return reverse_template_llm_parse(rendered_template, template)
+
+
+async def areverse_template_compiled(rendered_template, template, *args, **kwargs):
+    parser = compile_reverse_parser(template)
+    if parser is not None:
+        try:
+            return parser.parse(rendered_template)
+        except ValueError:
+            event("parse_fallback", reason="no_match")
+    else:
+        event("parse_fallback", reason="not_compilable")
+    return await areverse_template_llm_parse(rendered_template, template)
 
-    return json.loads(response.choices[0].message.content)["values"]
+
+_xml_special_characters = "&<>\"'"
 
 
 def escape_xml_characters(input_string):
@@ -206,15 +735,13 @@ def escape_xml_characters(input_string):
         input_string (str): The string to be escaped.
 
     Returns:
-        str: The escaped string where characters like '<', '>', '&', '"', and "'" are replaced with their corresponding XML entities.
+        str: The escaped string where characters like '<', '>', '&', '"', and "'" are replaced with their corresponding XML entities
+        (quotes as the numeric references `&#34;` and `&#39;`). The input string itself is returned when it has nothing to escape.
     """
-    return (
-        input_string.replace("&", "&amp;")
-        .replace("<", "&lt;")
-        .replace(">", "&gt;")
-        .replace('"', "&quot;")
-        .replace("'", "&apos;")
-    )
+    if not any(character in input_string for character in _xml_special_characters):
+        return input_string
+    # Single pass in C, the same escaping as the XML renderer.
+    return str(escape(input_string))
 
 
 def recursive_escape_xml(input_object):
@@ -225,18 +752,27 @@ def recursive_escape_xml(input_object):
         input_object (str, list, dict): The input that may contain strings to be escaped.
 
     Returns:
-        The input object with all its strings XML-escaped.
+        The input object with all its strings XML-escaped. Lists and dicts without anything to escape are
+        returned as they are, not copied.
     """
     if isinstance(input_object, str):
         return escape_xml_characters(input_object)
     elif isinstance(input_object, list):
-        return [recursive_escape_xml(item) for item in input_object]
+        escaped = [recursive_escape_xml(item) for item in input_object]
+        return input_object if all(new is old for new, old in zip(escaped, input_object)) else escaped
     elif isinstance(input_object, dict):
-        return {key: recursive_escape_xml(value) for key, value in input_object.items()}
+        escaped = {key: recursive_escape_xml(value) for key, value in input_object.items()}
+        return input_object if all(escaped[key] is value for key, value in input_object.items()) else escaped
     else:
         return input_object  # If it's not a string, list, or dict, return it unchanged.
 
 
+try:
+    from yaml import CSafeLoader as YamlLoader, CDumper as _BaseYamlDumper
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader, Dumper as _BaseYamlDumper
+
+
 def str_presenter(dumper, data):
     if "\n" in data:  # check for presence of newline character
         # Strip leading and trailing whitespace from each line
@@ -245,19 +781,148 @@ def str_presenter(dumper, data):
     return dumper.represent_scalar("tag:yaml.org,2002:str", data)
 
 
-yaml.add_representer(str, str_presenter)
+class YamlDumper(_BaseYamlDumper):
+    """Dumper writing multiline strings as block scalars, without changing the global `yaml.dump`."""
+
+
+class PythonYamlDumper(yaml.Dumper):
+    """Pure-Python `YamlDumper`."""
+
+
+YamlDumper.add_representer(str, str_presenter)
+PythonYamlDumper.add_representer(str, str_presenter)
+
+
+# Markers of output that libyaml may write differently from the pure-Python emitter, matched on the output with
+# a newline prepended: characters outside of the BMP (e.g. emojis) and NEL escaped as \U... and \N even with
+# allow_unicode, complex keys (`? `) for keys with a carriage return, empty keys written as `'':` instead of
+# complex keys, and the start of double-quoted scalars, which libyaml folds differently.
+_yaml_libyaml_markers = re.compile(r"""\\[UN]|\n[ -]*(?:\? |(?:''|""):[ \n])|(?P<quote>(?:\n[ -]*|: )")""")
+_yaml_closed_double_quoted = re.compile(r'"(?:[^"\\\n]|\\.)*"')
+
+
+def _yaml_folds_differently(output):
+    # libyaml folds long double-quoted scalars at other points than the pure-Python emitter, without its `\`
+    # continuations, and keeps some of them on a line the pure-Python emitter folds. The scalars are found
+    # with the libyaml parser, so double quotes inside block scalars do not count.
+    for parse_event in yaml.parse(output, Loader=YamlLoader):
+        if isinstance(parse_event, yaml.ScalarEvent) and parse_event.style == '"':
+            start, end = parse_event.start_mark.index, parse_event.end_mark.index
+            line_end = output.find("\n", start)
+            if line_end < end or line_end - output.rfind("\n", 0, start) > 81:
+                return True
+    return False
+
+
+def _yaml_differs_from_python(output):
+    text = "\n" + output
+    folded = False
+    for match in _yaml_libyaml_markers.finditer(text):
+        if match.lastgroup != "quote":
+            return True
+        if folded:
+            continue
+        # Only double-quoted scalars longer than a line or spanning several lines can be folded.
+        quote = match.end() - 1
+        line_start = text.rfind("\n", 0, quote) + 1
+        line_end = text.find("\n", quote)
+        folded = line_end - line_start > 80 or not _yaml_closed_double_quoted.match(text, quote, line_end)
+    return folded and _yaml_folds_differently(output)
 
 
 def convert_dict_to_yaml(data_dict):
-    return yaml.dump(data_dict, sort_keys=False, default_flow_style=False, allow_unicode=True)
+    options = {"sort_keys": False, "default_flow_style": False, "allow_unicode": True}
+    output = yaml.dump(data_dict, Dumper=YamlDumper, **options)
+    # The pure-Python emitter is used instead when libyaml may have written the data differently.
+    if _BaseYamlDumper is not yaml.Dumper and _yaml_differs_from_python(output):
+        output = yaml.dump(data_dict, Dumper=PythonYamlDumper, **options)
+    return output
 
 
-def otag(tag, **attributes):
+_yaml_files = {}
+_yaml_files_lock = threading.Lock()
+
+
+def load_yaml_file(path):
+    """
+    Loads a YAML file, reusing the previous result while the file mtime and size are unchanged.
+
+    The returned object is shared between calls and must not be modified.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _yaml_files.get(path)
+    if cached is not None and cached[0] == signature:
+        event("yaml_cache", hit=True)
+        return cached[1]
+    event("yaml_cache", hit=False)
+    with open(path, "r") as file:
+        value = yaml.load(file, Loader=YamlLoader)
+    with _yaml_files_lock:
+        _yaml_files[path] = (signature, value)
+    return value
+
+
+def open_tag(tag, **attributes):
     attributes_str = " ".join([f'{key}="{value}"' for key, value in attributes.items()])
     if len(attributes_str) > 0:
         attributes_str = " " + attributes_str
-    return f"&lt;{tag}{attributes_str}&gt;"
+    return f"<{tag}{attributes_str}>"
+
+
+def close_tag(tag):
+    return f"</{tag}>"
+
+
+def otag(tag, **attributes):
+    # Returns Markup so that the XML renderer does not escape the entities twice.
+    attributes_str = " ".join([f'{key}="{escape(value)}"' for key, value in attributes.items()])
+    if len(attributes_str) > 0:
+        attributes_str = " " + attributes_str
+    return Markup(f"&lt;{tag}{attributes_str}&gt;")
 
 
 def ctag(tag):
-    return f"&lt;/{tag}&gt;"
+    return Markup(f"&lt;/{tag}&gt;")
+
+
+_messages_open = re.compile(r"<messages>\s*<role>\s*(?:\{\{(.*?)\}\}|([^<{]*?))\s*</role>\s*<content>", re.DOTALL)
+_messages_close = re.compile(r"</content>\s*</messages>")
+
+
+@lru_cache(maxsize=256)
+def compile_message_skeleton(template):
+    """
+    Rewrites a `<root>` prompt template so that it emits its messages directly instead of XML.
+
+    Every `<messages><role>...</role><content>...</content></messages>` block becomes a
+    `{% call _message(role) %}...{% endcall %}` block and `<text_prompt>` a `{% call _text_prompt() %}`
+    block, so rendering builds the list of messages in a single pass without serializing and parsing XML.
+
+    Args:
+        template (str): The content of the `<prompt>` tag.
+
+    Returns:
+        str: The rewritten template, or None if the template uses other XML (nested tags, entities,
+        comments, ...) and must go through the XML renderer.
+    """
+    template = template.strip()
+    if not (template.startswith("<root>") and template.endswith("</root>")):
+        return None
+    skeleton = template[len("<root>") : -len("</root>")]
+
+    def open_message(match):
+        role = match.group(1).strip() if match.group(1) is not None else json.dumps(match.group(2).strip())
+        return "{% call _message(" + role + ") %}"
+
+    skeleton = _messages_open.sub(open_message, skeleton)
+    skeleton = _messages_close.sub("{% endcall %}", skeleton)
+    skeleton = skeleton.replace("<text_prompt>", "{% call _text_prompt() %}").replace("</text_prompt>", "{% endcall %}")
+    try:
+        tokens = list(_jinja_env.lex(skeleton))
+    except Exception:
+        return None
+    if any(token_type == "data" and ("<" in value or "&" in value) for _, token_type, value in tokens):
+        return None
+    return skeleton
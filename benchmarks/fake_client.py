@@ -0,0 +1,126 @@
+import re
+import json
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+
+def questions_response(size):
+    """Deterministic response following the output template of `generate_question.xml.j2`."""
+    lines = ["Questions:"]
+    for i in range(size):
+        lines.append(
+            f"- What does section {i} of the document explain about topic {i % 7}? [[{i:08x}]] [[{i * 31:08x}]]"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _usage(prompt, text):
+    prompt_tokens = len(json.dumps(prompt)) // 4
+    completion_tokens = len(text) // 4
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens
+    )
+
+
+class FakeServerError(Exception):
+    """Retryable error raised by the fake clients, shaped like the OpenAI API errors."""
+
+    status_code = 503
+
+
+class _Endpoint:
+    def __init__(self, client, chat):
+        self.client = client
+        self.chat = chat
+
+    def _text(self, prompt, kwargs):
+        if kwargs.get("response_format", {}).get("type") == "json_object":
+            # Batched parse requests number their items, answer one entry per item.
+            items = len(re.findall(r"^Item \d+:$", prompt[-1]["content"], re.M))
+            if items:
+                return json.dumps({"items": [{"item": i + 1, "values": {"questions": []}} for i in range(items)]})
+            return json.dumps({"values": {"questions": []}})
+        return self.client.response_text
+
+    def _chunks(self, text):
+        size = self.client.chunk_size
+        for i in range(0, len(text), size):
+            delta = SimpleNamespace(content=text[i : i + size], text=text[i : i + size])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    def _response(self, prompt, text):
+        if self.chat:
+            choice = SimpleNamespace(message=SimpleNamespace(role="assistant", content=text))
+        else:
+            choice = SimpleNamespace(text=text)
+        return SimpleNamespace(choices=[choice], usage=_usage(prompt, text))
+
+    def _latency(self):
+        # Returns the latency of a new call, or raises the configured failures.
+        with self.client.lock:
+            self.client.calls += 1
+            call = self.client.calls
+        if call <= self.client.failures:
+            raise FakeServerError("The server is overloaded")
+        latency = self.client.latency
+        return latency(call) if callable(latency) else latency
+
+    def create(self, messages=None, prompt=None, stream=False, **kwargs):
+        latency = self._latency()
+        prompt = messages if self.chat else prompt
+        text = self._text(prompt, kwargs)
+        if latency:
+            time.sleep(latency)
+        if stream:
+            return self._chunks(text)
+        return self._response(prompt, text)
+
+
+class _AsyncEndpoint(_Endpoint):
+    async def create(self, messages=None, prompt=None, stream=False, **kwargs):
+        latency = self._latency()
+        prompt = messages if self.chat else prompt
+        text = self._text(prompt, kwargs)
+        if latency:
+            await asyncio.sleep(latency)
+        if stream:
+            chunks = self._chunks(text)
+
+            async def iterate():
+                for chunk in chunks:
+                    yield chunk
+
+            return iterate()
+        return self._response(prompt, text)
+
+
+class FakeClient:
+    """
+    In-process stand-in for an OpenAI client (`client.chat.completions.create` and
+    `client.completions.create`), streaming or not, with a configurable latency.
+
+    Args:
+        response_text (str): The text returned by every generation request.
+        latency (float, callable): Seconds slept by every request, or a function of the call number
+            (starting at 1) returning them, e.g. to simulate a slow tail.
+        chunk_size (int): Characters per chunk when streaming.
+        failures (int): The number of first calls failing with a retryable `FakeServerError`.
+    """
+
+    endpoint_class = _Endpoint
+
+    def __init__(self, response_text=None, latency=0.0, chunk_size=16, failures=0):
+        self.response_text = response_text if response_text is not None else questions_response(10)
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.failures = failures
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=self.endpoint_class(self, chat=True))
+        self.completions = self.endpoint_class(self, chat=False)
+
+
+class AsyncFakeClient(FakeClient):
+    endpoint_class = _AsyncEndpoint
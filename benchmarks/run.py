@@ -0,0 +1,258 @@
+"""
+Benchmarks of the render, parse, streaming, batch, YAML and tail latency paths of alloprompt.
+
+    python -m benchmarks.run                      # run everything and print the results
+    python -m benchmarks.run --quick --only render,parse
+    python -m benchmarks.run --save-baseline      # store the results in benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.2
+
+When a baseline is given, the process exits with status 1 if any metric is worse than the baseline by
+more than the tolerance. The committed baseline comes from a full run on the reference machine: timings depend on
+the hardware, so CI saves its own baseline on the parent commit with the same runner before comparing.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from alloprompt import Prompt, RequestPolicy, ParseBatcher, utils
+from alloprompt.reverse_parser import compile_reverse_parser
+from benchmarks.fake_client import FakeClient, questions_response
+from benchmarks.templates import scaled_template_path, document, examples_data
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+KB = 1024
+
+
+def measure(function, min_time=0.2, min_runs=3, max_runs=1000):
+    """Returns the median duration of `function` in microseconds."""
+    durations = []
+    started = time.perf_counter()
+    while len(durations) < max_runs and (len(durations) < min_runs or time.perf_counter() - started < min_time):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1e6
+
+
+def peak_memory(function):
+    """Returns the peak memory allocated by `function` in KiB."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / KB
+    finally:
+        tracemalloc.stop()
+
+
+def prompt_variants(path, data):
+    return {
+        "xml": Prompt(path, data=data, structured_render=False),
+        "structured": Prompt(path, data=data),
+        "frozen": Prompt(path, data=data, freeze=True),
+    }
+
+
+def bench_render(results, quick):
+    path = scaled_template_path()
+    example_counts = (1, 100) if quick else (1, 10, 100, 1000)
+    input_sizes = (KB, 100 * KB) if quick else (KB, 100 * KB, 1024 * KB)
+    for count in example_counts:
+        for name, prompt in prompt_variants(path, examples_data(count)).items():
+            for size in input_sizes:
+                inputs = {"content": document(size)}
+                value = measure(lambda: prompt.render_prompt(inputs))
+                results[f"render.{name}.examples={count}.input={size // KB}KB"] = (value, "us", False)
+
+    prompts = prompt_variants(path, examples_data(10))
+    inputs = {"content": document(1024 * KB)}
+    for name, prompt in prompts.items():
+        value = peak_memory(lambda: prompt.render_prompt(inputs))
+        results[f"memory.render.{name}.input=1024KB"] = (value, "KiB", False)
+
+    for size in input_sizes:
+        inputs = {"content": document(size)}
+        results[f"escape.recursive_escape_xml.input={size // KB}KB"] = (
+            measure(lambda: utils.recursive_escape_xml(inputs)),
+            "us",
+            False,
+        )
+        xml = utils.render_jinja2(
+            "<root><messages><role>user</role><content>{{ content }}</content></messages></root>",
+            content=utils.escape_xml_characters(inputs["content"]),
+        )
+        results[f"parse_xml.input={size // KB}KB"] = (measure(lambda: utils.parse_xml(xml)), "us", False)
+
+
+def bench_parse(results, quick):
+    path = scaled_template_path()
+    prompt = Prompt(path)
+    parser = compile_reverse_parser(prompt.template["output_template"])
+    for count in (10, 100) if quick else (10, 100, 1000):
+        response = questions_response(count)
+        results[f"parse.compiled.questions={count}"] = (measure(lambda: parser.parse(response)), "us", False)
+
+    # Round trip through the LLM parser with a zero latency client: measures the local overhead only.
+    client = FakeClient()
+    utils.set_parse_client(client)
+    response = questions_response(10)
+    results["parse.llm_parse_overhead.questions=10"] = (
+        measure(lambda: utils.reverse_template_llm_parse(response, prompt.template["output_template"])),
+        "us",
+        False,
+    )
+
+    # Concurrent LLM parse calls of distinct responses, one request each or coalesced by a ParseBatcher.
+    items = 64 if quick else 256
+    responses = [questions_response(10) + f"- Item {i}? [[{i:08x}]] [[{i:08x}]]\n" for i in range(items)]
+    template = prompt.template["output_template"]
+    for name, batcher in (("unbatched", None), ("batched", ParseBatcher(window=0.01, max_batch=16))):
+        client = FakeClient(latency=0.005)
+        utils.set_parse_client(client)
+        utils.set_parse_batcher(batcher)
+        with ThreadPoolExecutor(32) as executor:
+            list(executor.map(lambda response: utils.reverse_template_llm_parse(response, template), responses))
+        results[f"parse.llm_parse.{name}.requests_per_item"] = (client.calls / items, "requests", False)
+    utils.set_parse_batcher(None)
+
+
+def bench_stream(results, quick):
+    path = scaled_template_path()
+    parser = compile_reverse_parser(Prompt(path).template["output_template"])
+
+    def reparse(text):
+        # The accumulating path: the same compiled parser run again on the whole text after every chunk.
+        try:
+            return parser.parse(text)
+        except ValueError:
+            return None
+
+    for count in (10, 100) if quick else (10, 100, 1000):
+        client = FakeClient(questions_response(count), chunk_size=16)
+        chunks = len(client.response_text) // client.chunk_size + 1
+        for name, stream_parser in (("compiled", "compiled"), ("accumulate", reparse)):
+            prompt = Prompt(path, default_client=client, stream_output_parsing_function=stream_parser)
+            value = measure(lambda: list(prompt.chat_complete({"content": "text"}, stream=True))) / chunks
+            results[f"stream.{name}.questions={count}.per_chunk"] = (value, "us", False)
+
+
+def bench_batch(results, quick):
+    path = scaled_template_path()
+    items = 50 if quick else 200
+    for workers in (1, 8) if quick else (1, 8, 32):
+        client = FakeClient(questions_response(10), latency=0.01)
+        prompt = Prompt(path, data=examples_data(10), default_client=client, output_parsing_function="compiled")
+        inputs = [{"content": document(KB)} for _ in range(items)]
+        start = time.perf_counter()
+        for _, __, error in prompt.chat_complete_many(inputs, max_workers=workers):
+            if error is not None:
+                raise error
+        results[f"batch.workers={workers}.throughput"] = (items / (time.perf_counter() - start), "items/s", True)
+
+
+def bench_yaml(results, quick):
+    for count in (10, 100) if quick else (10, 100, 1000):
+        data = examples_data(count)
+        results[f"yaml.dump.examples={count}"] = (measure(lambda: utils.convert_dict_to_yaml(data)), "us", False)
+        with tempfile.NamedTemporaryFile("w", suffix=".yaml", delete=False) as file:
+            file.write(utils.convert_dict_to_yaml(data))
+        try:
+            results[f"yaml.load_file.examples={count}"] = (
+                measure(lambda: utils.load_yaml_file(file.name)),
+                "us",
+                False,
+            )
+        finally:
+            os.remove(file.name)
+
+
+def bench_tail(results, quick):
+    path = scaled_template_path()
+    requests = 50 if quick else 200
+    # One request in ten is 20 times slower than the others.
+    latency = lambda call: 0.2 if call % 10 == 3 else 0.01
+    policies = {"none": None, "hedged": RequestPolicy(hedge_after=0.03)}
+    for name, policy in policies.items():
+        client = FakeClient(questions_response(10), latency=latency)
+        prompt = Prompt(path, default_client=client, output_parsing_function="compiled", request_policy=policy)
+        durations = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            prompt.chat_complete({"content": "text"})
+            durations.append(time.perf_counter() - start)
+        durations.sort()
+        results[f"tail.{name}.p99"] = (durations[int(len(durations) * 0.99) - 1] * 1e3, "ms", False)
+        results[f"tail.{name}.requests_per_call"] = (client.calls / requests, "requests", False)
+
+
+BENCHMARKS = {
+    "render": bench_render,
+    "parse": bench_parse,
+    "stream": bench_stream,
+    "batch": bench_batch,
+    "yaml": bench_yaml,
+    "tail": bench_tail,
+}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, (value, unit, higher_is_better) in results.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]["value"]
+        ratio = value / reference if reference else 1.0
+        if (ratio < 1 - tolerance) if higher_is_better else (ratio > 1 + tolerance):
+            regressions.append((name, reference, value, unit))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="Run smaller variants of every benchmark.")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="Comma separated benchmarks to run.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file.")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Write the results to {DEFAULT_BASELINE}.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown (default 0.25).")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.only.split(","):
+        BENCHMARKS[name](results, args.quick)
+
+    width = max(len(name) for name in results)
+    for name, (value, unit, _) in results.items():
+        print(f"{name:<{width}}  {value:>12.1f} {unit}")
+
+    serialized = {
+        name: {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+        for name, (value, unit, higher_is_better) in results.items()
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(serialized, file, indent=2)
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, "w") as file:
+            json.dump(serialized, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, reference, value, unit in regressions:
+            print(f"REGRESSION {name}: {reference:.1f} -> {value:.1f} {unit}")
+        if regressions:
+            return 1
+        print(f"No regression beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import os
+
+EXAMPLE_TEMPLATE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "example_templates", "generate_question.xml.j2"
+)
+
+
+def scaled_template_path():
+    """The template scaled by the benchmarks: its few-shot examples come from `data.examples`."""
+    return EXAMPLE_TEMPLATE
+
+
+def document(size):
+    """A deterministic document of about `size` characters, with characters that need XML escaping."""
+    sentence = "The <model> & its 'tokenizer' split \"text\" into pieces; each piece maps to an id. "
+    return (sentence * (size // len(sentence) + 1))[:size]
+
+
+def examples_data(count, content_size=400):
+    return {
+        "examples": [
+            {
+                "content": document(content_size),
+                "questions": [
+                    {"question": f"What does example {i} say about question {j}?", "hashes": [f"{i:04x}{j:04x}"]}
+                    for j in range(3)
+                ],
+            }
+            for i in range(count)
+        ]
+    }
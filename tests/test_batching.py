@@ -0,0 +1,116 @@
+import re
+import json
+import asyncio
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from alloprompt import ParseBatcher, utils
+
+TEMPLATE = "Answer: {{ answer }}"
+
+
+class ParseClient:
+    """Parse client answering `{"answer": <rendered output>}` for every item, optionally mangling batches."""
+
+    def __init__(self, mangle=None):
+        self.mangle = mangle
+        self.batches = []
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=self)
+
+    def answer(self, messages):
+        outputs = re.findall(r"Rendered output:\n(.*)", messages[-1]["content"])
+        if len(messages) > 4:
+            return {"values": {"answer": outputs[0]}}
+        with self.lock:
+            self.batches.append(len(outputs))
+        items = [{"item": i + 1, "values": {"answer": output}} for i, output in enumerate(outputs)]
+        return {"items": self.mangle(items) if self.mangle else items}
+
+    def create(self, messages, **kwargs):
+        content = json.dumps(self.answer(messages))
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+class AsyncParseClient(ParseClient):
+    async def create(self, messages, **kwargs):
+        return ParseClient.create(self, messages, **kwargs)
+
+
+@pytest.fixture
+def clients():
+    def use(mangle=None):
+        client, async_client = ParseClient(mangle), AsyncParseClient(mangle)
+        utils.set_parse_client(client)
+        utils.set_async_parse_client(async_client)
+        return client, async_client
+
+    yield use
+    utils.set_parse_client(None)
+    utils.set_async_parse_client(None)
+
+
+def parse_all(batcher, responses):
+    with ThreadPoolExecutor(len(responses)) as executor:
+        return list(executor.map(lambda response: batcher.parse(response, TEMPLATE), responses))
+
+
+def expected(responses):
+    return [{"answer": response} for response in responses]
+
+
+def test_fan_out(clients):
+    client, _ = clients()
+    batcher = ParseBatcher(window=0.05, max_batch=8)
+    responses = [f"response {i}" for i in range(8)]
+    assert parse_all(batcher, responses) == expected(responses)
+    assert client.batches == [8]
+    assert batcher.stats() == {"requests": 1, "items": 8, "memo_hits": 0}
+
+
+def test_memo(clients):
+    clients()
+    batcher = ParseBatcher(window=0.01)
+    assert batcher.parse("same", TEMPLATE) == batcher.parse("same", TEMPLATE) == {"answer": "same"}
+    assert batcher.stats()["requests"] == 1 and batcher.stats()["memo_hits"] == 1
+
+
+@pytest.mark.parametrize(
+    "mangle",
+    [
+        lambda items: items[::-1],
+        lambda items: items[1:],
+        lambda items: [{"values": item["values"]} for item in items],
+        lambda items: [{**item, "item": 1} for item in items],
+        lambda items: [{**item, "values": {"answer": "merged"}, "item": 2} for item in items[:2]] + items[2:],
+    ],
+    ids=["reordered", "dropped", "unnumbered", "duplicated", "merged"],
+)
+def test_mangled_batch(clients, mangle):
+    client, _ = clients(mangle)
+    batcher = ParseBatcher(window=0.05, max_batch=4)
+    responses = [f"response {i}" for i in range(4)]
+    assert parse_all(batcher, responses) == expected(responses)
+    # Memoized values must belong to their own item too.
+    assert [batcher.parse(response, TEMPLATE) for response in responses] == expected(responses)
+
+
+def test_unparsable_batch_falls_back(clients):
+    client, _ = clients(lambda items: "not a list")
+    batcher = ParseBatcher(window=0.05, max_batch=3)
+    responses = [f"response {i}" for i in range(3)]
+    assert parse_all(batcher, responses) == expected(responses)
+    assert batcher.stats()["requests"] == 4
+
+
+def test_async_fan_out_and_fallback(clients):
+    _, async_client = clients(lambda items: items[::-1][1:])
+    batcher = ParseBatcher(window=0.05, max_batch=8)
+    responses = [f"response {i}" for i in range(6)]
+
+    async def main():
+        return await asyncio.gather(*(batcher.aparse(response, TEMPLATE) for response in responses))
+
+    assert asyncio.run(main()) == expected(responses)
+    assert async_client.batches == [6]
@@ -0,0 +1,96 @@
+import os
+import time
+import asyncio
+import sqlite3
+import pytest
+from alloprompt import Prompt, ResponseCache
+from benchmarks.fake_client import FakeClient, AsyncFakeClient, questions_response
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "example_templates", "generate_question.xml.j2")
+MESSAGES = [{"role": "user", "content": "text"}]
+
+
+def test_key_temperature_bypass():
+    cache = ResponseCache()
+    assert cache.key(MESSAGES, {"model": "m", "temperature": 0}) is not None
+    assert cache.key(MESSAGES, {"model": "m"}) is None
+    assert cache.key(MESSAGES, {"model": "m", "temperature": None}) is None
+    assert cache.key(MESSAGES, {"model": "m", "temperature": 0.7}) is None
+    assert cache.key(MESSAGES, {"model": "m", "temperature": 0, "stream": True}) is None
+    assert ResponseCache(force=True).key(MESSAGES, {"model": "m", "temperature": 0.7}) is not None
+
+
+def test_key_depends_on_prompt_and_args():
+    cache = ResponseCache()
+    key = cache.key(MESSAGES, {"model": "m", "temperature": 0})
+    assert key == cache.key(MESSAGES, {"temperature": 0, "model": "m"})
+    assert key != cache.key(MESSAGES, {"model": "other", "temperature": 0})
+    assert key != cache.key([{"role": "user", "content": "other"}], {"model": "m", "temperature": 0})
+
+
+def test_memory_lru():
+    cache = ResponseCache(max_entries=2)
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") is None and cache.get("c") == "C"
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 2}
+
+
+def test_sqlite_persists(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    ResponseCache(path).set("key", "value")
+    assert ResponseCache(path).get("key") == "value"
+
+
+def test_ttl(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(path, ttl=0.05)
+    cache.set("old", "value")
+    time.sleep(0.1)
+    assert cache.get("old") is None
+    cache.set("expired", "value")
+    time.sleep(0.1)
+    cache.set("new", "value")
+    rows = sqlite3.connect(path).execute("SELECT key FROM responses").fetchall()
+    assert rows == [("new",)]
+    assert ResponseCache(path, ttl=0.05).get("new") == "value"
+
+
+def test_prompt_cache_hit():
+    client = FakeClient(questions_response(2))
+    prompt = Prompt(TEMPLATE, default_client=client, output_parsing_function="compiled", response_cache=ResponseCache())
+    first = prompt.chat_complete({"content": "text"}, temperature=0)
+    assert prompt.chat_complete({"content": "text"}, temperature=0) == first
+    assert client.calls == 1
+    prompt.chat_complete({"content": "text"})
+    assert client.calls == 2
+
+
+def test_prompt_does_not_cache_unparsable_response():
+    client = FakeClient("Not the expected format")
+    cache = ResponseCache()
+    prompt = Prompt(TEMPLATE, default_client=client, output_parsing_function="compiled", response_cache=cache)
+    prompt.reverse_template = lambda response, template, _: 1 / 0
+    for _ in range(2):
+        with pytest.raises(Exception):
+            prompt.chat_complete({"content": "text"}, temperature=0)
+    assert client.calls == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_async_prompt_cache(tmp_path):
+    client = AsyncFakeClient(questions_response(2))
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    prompt = Prompt(
+        TEMPLATE, default_async_client=client, output_parsing_function="compiled", response_cache=cache
+    )
+
+    async def main():
+        first = await prompt.achat_complete({"content": "text"}, temperature=0)
+        return first, await prompt.achat_complete({"content": "text"}, temperature=0)
+
+    first, second = asyncio.run(main())
+    assert first == second and len(first["questions"]) == 2
+    assert client.calls == 1
+    rows = sqlite3.connect(str(tmp_path / "responses.sqlite")).execute("SELECT value FROM responses").fetchall()
+    assert rows == [(client.response_text,)]
@@ -0,0 +1,33 @@
+import time
+from alloprompt.utils import run_candidate_tests
+
+PASSING = "def test():\n    assert 1 + 1 == 2\n"
+FAILING = "def test():\n    assert False, 'wrong'\n"
+IGNORES_SIGTERM = """
+import signal
+import time
+
+def test():
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(100)
+"""
+
+
+def test_first_passing_candidate():
+    passed, failures = run_candidate_tests([FAILING, PASSING], timeout=10)
+    assert passed == PASSING
+    # The candidates run in parallel: the failing one is only reported when it finished first.
+    assert all(code == FAILING and "wrong" in output for code, output in failures)
+
+
+def test_no_passing_candidate():
+    passed, failures = run_candidate_tests([FAILING], timeout=10)
+    assert passed is None and len(failures) == 1
+
+
+def test_candidate_ignoring_sigterm_is_killed():
+    start = time.monotonic()
+    passed, failures = run_candidate_tests([IGNORES_SIGTERM], timeout=0.5)
+    assert time.monotonic() - start < 5
+    assert passed is None
+    assert failures[0][1].startswith("Timeout")
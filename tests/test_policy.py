@@ -0,0 +1,123 @@
+import os
+import time
+import asyncio
+import pytest
+from alloprompt import Prompt, RequestPolicy
+from alloprompt.policy import RequestTimeout, is_retryable
+from benchmarks.fake_client import FakeClient, AsyncFakeClient, FakeServerError, questions_response
+
+TEMPLATE = os.path.join(os.path.dirname(__file__), "..", "example_templates", "generate_question.xml.j2")
+MESSAGES = [{"role": "user", "content": "text"}]
+
+
+def create(client):
+    return lambda: client.chat.completions.create(model="model", messages=MESSAGES)
+
+
+def test_is_retryable():
+    assert is_retryable(FakeServerError())
+    assert is_retryable(TimeoutError()) and is_retryable(ConnectionError())
+    assert not is_retryable(ValueError())
+
+
+def test_retry_until_success():
+    client = FakeClient(failures=2)
+    response = RequestPolicy(max_retries=2, backoff=0).call(create(client))
+    assert response.choices[0].message.content == client.response_text
+    assert client.calls == 3
+
+
+def test_retries_exhausted():
+    client = FakeClient(failures=3)
+    with pytest.raises(FakeServerError):
+        RequestPolicy(max_retries=2, backoff=0).call(create(client))
+    assert client.calls == 3
+
+
+def test_not_retryable_error():
+    calls = []
+
+    def function():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        RequestPolicy(max_retries=2, backoff=0).call(function)
+    assert len(calls) == 1
+
+
+def test_timeout():
+    client = FakeClient(latency=1.0)
+    start = time.perf_counter()
+    with pytest.raises(RequestTimeout):
+        RequestPolicy(timeout=0.05, max_retries=0).call(create(client))
+    assert time.perf_counter() - start < 0.5
+
+
+def test_timeout_is_retried():
+    client = FakeClient(latency=lambda call: 1.0 if call == 1 else 0)
+    response = RequestPolicy(timeout=0.05, max_retries=1, backoff=0).call(create(client))
+    assert response.choices[0].message.content == client.response_text
+    assert client.calls == 2
+
+
+def test_hedge_answers_first():
+    client = FakeClient(latency=lambda call: 1.0 if call == 1 else 0.01)
+    start = time.perf_counter()
+    RequestPolicy(hedge_after=0.05).call(create(client))
+    assert time.perf_counter() - start < 0.5
+    assert client.calls == 2
+
+
+def test_no_hedge_for_fast_requests():
+    client = FakeClient(latency=0.001)
+    policy = RequestPolicy(hedge_after=0.5)
+    for _ in range(5):
+        policy.call(create(client))
+    assert client.calls == 5
+
+
+def test_hedge_percentile():
+    policy = RequestPolicy(hedge_percentile=90, min_samples=10)
+    assert policy.hedge_delay() is None
+    for i in range(1, 11):
+        policy.record_latency(i / 10)
+    assert policy.hedge_delay() == 1.0
+
+
+def test_async_retry_and_hedge():
+    client = AsyncFakeClient(failures=1, latency=lambda call: 1.0 if call == 2 else 0.01)
+    policy = RequestPolicy(hedge_after=0.05, backoff=0)
+
+    async def main():
+        return await policy.acall(lambda: client.chat.completions.create(model="model", messages=MESSAGES))
+
+    start = time.perf_counter()
+    response = asyncio.run(main())
+    assert response.choices[0].message.content == client.response_text
+    assert time.perf_counter() - start < 0.5
+    assert client.calls == 3
+
+
+def test_async_timeout():
+    client = AsyncFakeClient(latency=1.0)
+    policy = RequestPolicy(timeout=0.05, max_retries=0)
+
+    async def main():
+        return await policy.acall(lambda: client.chat.completions.create(model="model", messages=MESSAGES))
+
+    with pytest.raises(RequestTimeout):
+        asyncio.run(main())
+
+
+def test_prompt_request_policy():
+    client = FakeClient(questions_response(3), failures=1)
+    prompt = Prompt(
+        TEMPLATE,
+        default_client=client,
+        output_parsing_function="compiled",
+        request_policy=RequestPolicy(backoff=0),
+    )
+    values = prompt.chat_complete({"content": "text"})
+    assert len(values["questions"]) == 3
+    assert client.calls == 2
@@ -0,0 +1,37 @@
+import os
+import shutil
+import pytest
+from alloprompt import PromptRegistry, utils
+
+TEMPLATES = os.path.join(os.path.dirname(__file__), "..", "example_templates")
+
+
+@pytest.fixture
+def directory(tmp_path):
+    shutil.copy(os.path.join(TEMPLATES, "generate_question.xml.j2"), tmp_path / "generate_question.xml.j2")
+    return tmp_path
+
+
+def test_registry_does_not_change_global_settings(directory):
+    bytecode_cache = utils._jinja_env.bytecode_cache
+    PromptRegistry(str(directory))
+    assert utils._jinja_env.bytecode_cache is bytecode_cache
+
+
+def test_registry_prompts(directory):
+    registry = PromptRegistry(str(directory))
+    assert registry.names() == ["generate_question"] and "generate_question" in registry
+    prompt = registry["generate_question"]
+    assert registry["generate_question"] is prompt
+    assert registry.get("generate_question", data={"examples": []}) is not prompt
+    with pytest.raises(KeyError):
+        registry["missing"]
+
+
+def test_registry_reloads_changed_file(directory):
+    registry = PromptRegistry(str(directory))
+    prompt = registry["generate_question"]
+    path = directory / "generate_question.xml.j2"
+    path.write_text(path.read_text().replace("list all the questions", "list every question"))
+    os.utime(path, ns=(0, 1))
+    assert registry["generate_question"] is not prompt
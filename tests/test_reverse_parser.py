@@ -0,0 +1,92 @@
+import time
+import pytest
+from alloprompt.reverse_parser import ReverseParser, compile_reverse_parser
+
+QUESTIONS_TEMPLATE = """
+  Questions:
+  {% for question in questions %}
+  - {{question.question}} {% for hash in question.hashes %}[[{{hash}}]] {% endfor %}
+  {% endfor %}
+"""
+
+
+def questions_response(count, hashes=2):
+    lines = [f"- What is item {i}? " + "".join(f"[[h{i}{j}]] " for j in range(hashes)) for i in range(count)]
+    return "Questions:\n" + "\n".join(lines) + "\n"
+
+
+def test_parse_nested_loops():
+    values = ReverseParser(QUESTIONS_TEMPLATE).parse(questions_response(3))
+    assert values == {
+        "questions": [{"question": f"What is item {i}?", "hashes": [f"h{i}0", f"h{i}1"]} for i in range(3)]
+    }
+
+
+def test_parse_values_containing_delimiters():
+    response = "Questions:\n- Is [[x]] ok? \n- Why - not? [[a]] [[b]] \n"
+    values = ReverseParser(QUESTIONS_TEMPLATE).parse(response)
+    assert values == {
+        "questions": [{"question": "Is [[x]] ok?", "hashes": []}, {"question": "Why - not?", "hashes": ["a", "b"]}]
+    }
+
+
+def test_parse_text_after_loop():
+    parser = ReverseParser("A: {% for a in xs %}<{{ a }}> {% endfor %}\nB: {% for b in ys %}({{ b.v }}){% endfor %}\nEnd {{ tail }}")
+    values = parser.parse("A: <1> <2> \nB: (x (p) End)(y)\nEnd done")
+    assert values == {"xs": ["1", "2"], "ys": [{"v": "x (p) End"}, {"v": "y"}], "tail": "done"}
+
+
+def test_parse_multiline_variable():
+    parser = ReverseParser("Title: {{ title }}\nSummary:\n{{ summary }}\n")
+    assert parser.parse("Title: T\nSummary:\nline 1\nline 2\n") == {"title": "T", "summary": "line 1\nline 2"}
+
+
+@pytest.mark.parametrize("response", ["Answers:\n- a [[b]]", "Questions:\n- a [[b]]\nHope this helps!", ""])
+def test_parse_mismatch(response):
+    with pytest.raises(ValueError):
+        ReverseParser(QUESTIONS_TEMPLATE).parse(response)
+
+
+@pytest.mark.parametrize("trailing", ["Hope this helps!", " [[unclosed", "Sources: none"])
+def test_parse_mismatch_fails_fast(trailing):
+    parser = ReverseParser(QUESTIONS_TEMPLATE)
+    response = questions_response(12) + trailing
+    start = time.perf_counter()
+    with pytest.raises(ValueError):
+        parser.parse(response)
+    assert time.perf_counter() - start < 0.5
+
+
+def test_parse_many_items_fails_fast():
+    parser = ReverseParser(QUESTIONS_TEMPLATE)
+    start = time.perf_counter()
+    assert len(parser.parse(questions_response(1000, hashes=20))["questions"]) == 1000
+    with pytest.raises(ValueError):
+        parser.parse(questions_response(1000, hashes=20) + "Hope this helps!")
+    assert time.perf_counter() - start < 2
+
+
+def test_unsupported_template():
+    assert compile_reverse_parser("{% if x %}{{ x }}{% endif %}") is None
+    assert compile_reverse_parser("{{ a }}{{ b }}") is None
+
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_stream_parser(size):
+    parser = ReverseParser(QUESTIONS_TEMPLATE)
+    response = questions_response(4)
+    stream = parser.stream()
+    seen = []
+    for i in range(0, len(response), size):
+        seen.append(len(stream.feed(response[i : i + size]).get("questions", [])))
+    assert stream.close() == parser.parse(response)
+    assert seen == sorted(seen) and 0 < seen[-1]
+
+
+def test_stream_parser_mismatch():
+    parser = ReverseParser(QUESTIONS_TEMPLATE)
+    stream = parser.stream()
+    for chunk in ["Questions:\n- a [[b]] \n", "Hope this", " helps!"]:
+        stream.feed(chunk)
+    with pytest.raises(ValueError):
+        stream.close()
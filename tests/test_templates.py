@@ -0,0 +1,26 @@
+import pytest
+from alloprompt import utils
+
+
+@pytest.mark.parametrize("escape", [False, True])
+def test_render_error_shows_template_line(escape):
+    template = utils.get_compiled_template("first line\n{{ 1 / 0 }}\nlast line", escape)
+    with pytest.raises(Exception) as info:
+        utils.render_template(template)
+    assert "line 2" in str(info.value)
+    assert "{{ 1 / 0 }}" in str(info.value)
+
+
+def test_frozen_segment_error_shows_template_line():
+    segments = utils.split_template("Hello {{ name }}\n{{ input.value / 0 }}")
+    with pytest.raises(Exception) as info:
+        for _, segment in segments:
+            utils.render_template(segment, name="world", input={"value": 1})
+    assert "{{ input.value / 0 }}" in str(info.value)
+
+
+def test_compiled_template_cache():
+    template = utils.get_compiled_template("{{ a }} & {{ b }}")
+    assert utils.get_compiled_template("{{ a }} & {{ b }}") is template
+    assert utils.render_jinja2("{{ a }} & {{ b }}", a="<x>", b=1) == "<x> & 1"
+    assert utils.render_jinja2_xml("{{ a }} & {{ b }}", a="<x>", b=1) == "&lt;x&gt; & 1"
@@ -0,0 +1,68 @@
+import random
+import yaml
+import pytest
+from alloprompt import utils
+from alloprompt.utils import PythonYamlDumper, convert_dict_to_yaml, load_yaml_file
+
+OPTIONS = {"sort_keys": False, "default_flow_style": False, "allow_unicode": True}
+PIECES = [
+    "word", "the", " ", "  ", "\t", ":", "#", "-", "'", '"', "\\", "\x07", "\x85", "é", "日本", "😀", "\r", "\n",
+    "﻿", "\x00", "{", "[", ",", "?", "&", "*", "|", ">", "yes", "null", "1.5", "~", "\xa0", " ", "",
+]
+
+
+def python_yaml(data):
+    return yaml.dump(data, Dumper=PythonYamlDumper, **OPTIONS)
+
+
+def random_text(rng):
+    return "".join(rng.choice(PIECES) for _ in range(rng.choice([0, 1, 3, 10, 30, 80])))
+
+
+def random_value(rng, depth=0):
+    r = rng.random()
+    if depth < 4 and r < 0.25:
+        return {random_text(rng)[:12]: random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))}
+    if depth < 4 and r < 0.4:
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    if r < 0.5:
+        return rng.choice([1, 2.5, True, None, 0])
+    return random_text(rng)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"text": "smile 😀"},
+        {"text": "next\x85line"},
+        {"key\rwith carriage return": 1},
+        {"": "empty key", "nested": {"": [1, 2]}},
+        {"long": "\x07 " + "word " * 40},
+        {"block": 'He said: "' + "word " * 30 + '\nsecond line'},
+        {"key": "plain"},
+    ],
+)
+def test_same_output_as_pure_python(data):
+    assert convert_dict_to_yaml(data) == python_yaml(data)
+
+
+def test_same_output_as_pure_python_fuzz():
+    rng = random.Random(0)
+    for _ in range(2000):
+        data = {random_text(rng)[:12]: random_value(rng) for _ in range(rng.randint(1, 4))}
+        assert convert_dict_to_yaml(data) == python_yaml(data), data
+
+
+def test_common_data_keeps_libyaml(monkeypatch):
+    data = {"examples": [{"content": 'The "model" splits text: ' * 20, "questions": ["What?", "Why?"]}] * 10}
+    monkeypatch.setattr(utils, "PythonYamlDumper", None)
+    assert yaml.safe_load(convert_dict_to_yaml(data)) == data
+
+
+def test_load_yaml_file_cache(tmp_path):
+    path = tmp_path / "data.yaml"
+    path.write_text("a: 1\n")
+    first = load_yaml_file(str(path))
+    assert first == {"a": 1} and load_yaml_file(str(path)) is first
+    path.write_text("a: 22\n")
+    assert load_yaml_file(str(path)) == {"a": 22}